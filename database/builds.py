@@ -0,0 +1,135 @@
+"""
+This module provides functionality for publishing builds of the ROMs database without downtime.
+
+Each build is written into its own directory, `builds/<id>`, holding its database and its static
+files. A build is published by atomically replacing the `builds/current` symbolic link with one
+pointing to it, so readers always see either the previous build or the new one, complete. `roms.db`
+and the static files directory are symbolic links through `builds/current`, so they switch to the
+new build at once. Only the most recent builds are kept, so readers still using a previous build
+can finish with it.
+"""
+import os
+import shutil
+import time
+from database import db_manager
+
+BUILDS_DIR = 'builds'
+CURRENT_LINK = os.path.join(BUILDS_DIR, 'current')
+STATIC_DIRNAME = 'static'
+
+# Format of the build IDs, from the time the build was created, so they sort chronologically
+BUILD_ID_FORMAT = '%Y%m%dT%H%M%SZ'
+
+# Number of most recent builds kept by default, including the published one
+DEFAULT_KEPT_BUILDS = 3
+
+# Suffix of a static files directory deployed before builds were versioned, once moved aside
+UNVERSIONED_SUFFIX = '.unversioned'
+
+
+def get_build_dir(build_id):
+    """Retrieve the directory of a build."""
+    return os.path.join(BUILDS_DIR, build_id)
+
+
+def get_current_build():
+    """Retrieve the ID of the published build, or None if no build was published yet."""
+    if not os.path.islink(CURRENT_LINK):
+        return None
+    return os.readlink(CURRENT_LINK)
+
+
+def get_builds():
+    """Retrieve the IDs of all the builds, from the oldest."""
+    if not os.path.exists(BUILDS_DIR):
+        return []
+
+    return sorted(name for name in os.listdir(BUILDS_DIR)
+                  if os.path.isdir(get_build_dir(name)) and not os.path.islink(get_build_dir(name)))
+
+
+def create_build():
+    """Create the directory of a new build and return its ID."""
+    base_id = time.strftime(BUILD_ID_FORMAT, time.gmtime())
+
+    # Builds created within the same second are told apart by a counter
+    build_id = base_id
+    suffix = 1
+    while os.path.exists(get_build_dir(build_id)):
+        suffix += 1
+        build_id = f'{base_id}-{suffix}'
+
+    os.makedirs(get_build_dir(build_id))
+    return build_id
+
+
+def link_file(source_path, destination_path):
+    """Hard link a file, or copy it if it is on another file system."""
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copy2(source_path, destination_path)
+
+
+def prepare_static_dir(build_id, static_files_dir=None):
+    """Create the static files directory of a build from the one of the published build.
+
+    Files are hard linked, so unchanged files share their storage with the published build. They
+    must only be replaced, never modified in place. Returns the path of the directory.
+    """
+    static_dir = os.path.join(get_build_dir(build_id), STATIC_DIRNAME)
+
+    current_build = get_current_build()
+    if current_build:
+        previous_dir = os.path.join(get_build_dir(current_build), STATIC_DIRNAME)
+    else:
+        # The first build starts from the static files deployed before builds were versioned
+        previous_dir = static_files_dir
+
+    if previous_dir and os.path.isdir(previous_dir):
+        shutil.copytree(previous_dir, static_dir, symlinks=True, copy_function=link_file)
+    else:
+        os.makedirs(static_dir)
+
+    return static_dir
+
+
+def replace_link(path, target):
+    """Point a symbolic link to a target, atomically replacing the file or link at its path."""
+    temp_path = f'{path}.tmp'
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+
+    os.symlink(target, temp_path)
+    os.replace(temp_path, path)
+
+
+def publish_build(build_id, static_files_dir=None):
+    """Publish a build, switching the database and the static files directory to it at once."""
+    # The link target is relative to the builds directory, so it can be moved along with it
+    replace_link(CURRENT_LINK, build_id)
+
+    # Links through the current build only have to be created once
+    replace_link(db_manager.DB_NAME, os.path.join(CURRENT_LINK, db_manager.DB_NAME))
+
+    if static_files_dir:
+        # A directory cannot be atomically replaced with a link, so it is moved aside once
+        if os.path.isdir(static_files_dir) and not os.path.islink(static_files_dir):
+            os.rename(static_files_dir, f'{static_files_dir}{UNVERSIONED_SUFFIX}')
+        replace_link(static_files_dir, os.path.abspath(os.path.join(CURRENT_LINK, STATIC_DIRNAME)))
+
+
+def prune_builds(kept_builds=DEFAULT_KEPT_BUILDS):
+    """Remove the oldest builds, keeping the given number of most recent ones and the published one.
+
+    Returns the IDs of the removed builds.
+    """
+    current_build = get_current_build()
+    build_ids = get_builds()
+
+    removed = [build_id for build_id in build_ids[:max(len(build_ids) - kept_builds, 0)]
+               if build_id != current_build]
+    for build_id in removed:
+        shutil.rmtree(get_build_dir(build_id))
+
+    return removed
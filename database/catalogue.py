@@ -0,0 +1,164 @@
+"""
+This module provides functionality for exporting the ROMs database as a static catalogue, to be
+served from a CDN without querying the database.
+
+The catalogue is split into NDJSON shards, one per platform and one per region, with one entry per
+line along with its regions and links. Each shard is written precompressed with gzip and brotli.
+A manifest lists the content hash of every shard, so only the shards whose content changed since
+the last export are written again.
+"""
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import brotli
+
+CATALOGUE_DIRNAME = 'catalogue'
+MANIFEST_FILENAME = 'manifest.json'
+
+# Query retrieving the entries of a shard as JSON objects, ordered by title
+ENTRIES_QUERY = '''
+    SELECT json_object(
+        'slug', e.slug,
+        'title', e.title,
+        'platform', e.platform,
+        'rom_id', e.rom_id,
+        'boxart_url', e.boxart_url,
+        'regions', (
+            SELECT json_group_array(region) FROM (
+                SELECT region FROM regions_entries WHERE entry = e.id ORDER BY region
+            )
+        ),
+        'links', (
+            SELECT json_group_array(json_object(
+                'name', name,
+                'type', type,
+                'format', format,
+                'url', url,
+                'filename', filename,
+                'host', host,
+                'size', size,
+                'size_str', size_str,
+                'source_url', source_url
+            )) FROM (
+                SELECT * FROM links WHERE entry = e.id ORDER BY url
+            )
+        )
+    )
+    FROM entries e
+    WHERE {condition}
+    ORDER BY e.title, e.slug
+'''
+
+
+def get_shards(cur):
+    """Retrieve the shards of the catalogue, as `(path, condition, params)` tuples."""
+    shards = []
+
+    for (platform,) in cur.execute('SELECT DISTINCT platform FROM entries ORDER BY platform').fetchall():
+        shards.append((f'platforms/{platform}.ndjson', 'e.platform = ?', (platform,)))
+
+    for (region,) in cur.execute('SELECT DISTINCT region FROM regions_entries ORDER BY region').fetchall():
+        shards.append((f'regions/{region}.ndjson',
+                       'e.id IN (SELECT entry FROM regions_entries WHERE region = ?)', (region,)))
+
+    return shards
+
+
+def get_compressed_variants(content):
+    """Retrieve the file extensions and compressed contents a shard is written with."""
+    # No modification time, so unchanged content is compressed to the same bytes
+    return [('.gz', gzip.compress(content, mtime=0)), ('.br', brotli.compress(content))]
+
+
+def write_file(path, content):
+    """Write a file atomically, replacing it only once it is fully written."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def load_manifest(catalogue_dir):
+    """Load the manifest of a previous export, or an empty one if there is none."""
+    manifest_path = os.path.join(catalogue_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {'shards': {}}
+
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def get_shard_files(shard_path):
+    """Retrieve the file names a shard may be written to."""
+    return [shard_path] + [f'{shard_path}{extension}' for extension in ('.gz', '.br')]
+
+
+def export_catalogue(db_path, catalogue_dir):
+    """Export the database as sharded catalogue files, writing only the shards that changed.
+
+    Returns the number of shards written, unchanged and removed.
+    """
+    con = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    cur = con.cursor()
+
+    old_manifest = load_manifest(catalogue_dir)
+    manifest = {'shards': {}}
+    written = 0
+    unchanged = 0
+
+    for shard_path, condition, params in get_shards(cur):
+        lines = [row[0] for row in cur.execute(ENTRIES_QUERY.format(condition=condition), params)]
+        content = ''.join(f'{line}\n' for line in lines).encode('utf-8')
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        manifest['shards'][shard_path] = {
+            'hash': content_hash,
+            'entries': len(lines),
+            'size': len(content),
+            'compressed': ['.gz', '.br']
+        }
+
+        # Skip shards with the same content as in the previous export
+        old_shard = old_manifest['shards'].get(shard_path)
+        if old_shard == manifest['shards'][shard_path] and \
+                os.path.exists(os.path.join(catalogue_dir, shard_path)):
+            unchanged += 1
+            continue
+
+        written_files = {shard_path}
+        write_file(os.path.join(catalogue_dir, shard_path), content)
+        for extension, compressed_content in get_compressed_variants(content):
+            write_file(os.path.join(catalogue_dir, f'{shard_path}{extension}'), compressed_content)
+            written_files.add(f'{shard_path}{extension}')
+
+        # Remove the variants not written this time, so they are never served with outdated content
+        for filename in get_shard_files(shard_path):
+            file_path = os.path.join(catalogue_dir, filename)
+            if filename not in written_files and os.path.exists(file_path):
+                os.remove(file_path)
+        written += 1
+
+    cur.close()
+    con.close()
+
+    # Remove the shards that are not part of the catalogue anymore
+    removed = 0
+    for shard_path in old_manifest['shards']:
+        if shard_path in manifest['shards']:
+            continue
+
+        for filename in get_shard_files(shard_path):
+            file_path = os.path.join(catalogue_dir, filename)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        removed += 1
+
+    # The manifest is written last, so it never lists shards that are not written yet
+    write_file(os.path.join(catalogue_dir, MANIFEST_FILENAME),
+               json.dumps(manifest, indent=4, sort_keys=True).encode('utf-8'))
+
+    return written, unchanged, removed
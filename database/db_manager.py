@@ -4,15 +4,68 @@ It includes methods for initializing the database, inserting or updating entries
 """
 import sqlite3
 import os
-from utils.parse_utils import create_slug, create_search_key
+from itertools import combinations
+from utils.parse_utils import create_slug, create_search_key, create_slugs_and_keys, size_bytes_to_str
 
 DB_NAME = 'roms.db'
 DB_TEMP_NAME = 'roms_temp.db'
-DB_OLD_NAME = 'roms_old.db'
+
+# Directory containing the shard databases written by parallel build workers
+SHARDS_DIR = 'roms_shards'
+
+# Version of the database schema, stored in the database's user_version
+SCHEMA_VERSION = 8
 
 con = None
 cur = None
 
+# Link attributes repeated across many links, stored once in a lookup table each and
+# referenced by ID from the entry_links table
+LINK_LOOKUP_TABLES = {
+    'type': 'link_types',
+    'format': 'link_formats',
+    'host': 'link_hosts',
+    'source_url': 'link_source_urls'
+}
+
+# Size units of human-readable size strings, with the size in bytes of one unit
+SIZE_UNITS = [('B', 1), ('K', 1024), ('M', 1024 ** 2), ('G', 1024 ** 3), ('T', 1024 ** 4), ('P', 1024 ** 5)]
+
+# Sizes up to which the derived size string is exact, as larger sizes overflow in SQL
+MAX_DERIVED_SIZE = 1 << 53
+
+# IDs of the link attribute values inserted so far, for each lookup table
+lookup_ids = {}
+
+# Full-text indexes of the entries with their indexed columns, built in bulk when closing the database
+FTS_TABLES = {
+    'entries_fts': ('search_key',),
+    'entries_title_fts': ('title', 'rom_id')
+}
+
+# Minimum length of the title words kept in the similarity index
+MIN_SIMILAR_WORD_LENGTH = 3
+
+# Dimensions of the facet counts, with the SQL expressions of their values
+FACET_DIMENSIONS = {
+    'platform': 'e.platform',
+    'region': 'r.region',
+    'host': 'h.value',
+    'link_type': 't.value'
+}
+
+# Facet value counting entries and links with any value of a dimension
+ANY_FACET_VALUE = '*'
+
+# Order of the regions and links of an entry, shared by the entry details and the queries reading
+# them from their tables, so entries are returned the same way with entry details or without them.
+# Regions are keyed by entry and region, so their insertion order is not kept
+REGIONS_ORDER = 'region'
+LINKS_ORDER = 'host, type, name, url'
+
+# Number of links skipped as duplicates of a link already stored for the same entry
+duplicate_links = 0
+
 PLATFORMS = {
     'nes': {'brand': 'Nintendo', 'name': 'Nintendo Entertainment System'},
     'fds': {'brand': 'Nintendo', 'name': 'Famicom Disk System'},
@@ -73,18 +126,41 @@ REGIONS = {
 }
 
 
-def init_database():
+def get_size_str_sql(column):
+    """Build an SQL expression deriving the same size string as `size_bytes_to_str` from a size column.
+
+    Sizes are rounded to hundredths of their unit with integer arithmetic, rounding ties
+    to even like Python's string formatting does.
+    """
+    cases = []
+    for i, (suffix, unit_size) in enumerate(SIZE_UNITS):
+        hundredths = f'({column} * 100 / {unit_size})'
+        remainder = f'({column} * 100 % {unit_size})'
+        rounded = (f'({hundredths} + (CASE WHEN 2 * {remainder} > {unit_size} OR '
+                   f'(2 * {remainder} = {unit_size} AND {hundredths} % 2 = 1) THEN 1 ELSE 0 END))')
+        value = f"rtrim(rtrim(printf('%d.%02d', {rounded} / 100, {rounded} % 100), '0'), '.') || '{suffix}'"
+
+        if i < len(SIZE_UNITS) - 1:
+            cases.append(f'WHEN {column} < {SIZE_UNITS[i + 1][1]} THEN {value}')
+        else:
+            cases.append(f'ELSE {value}')
+
+    return f"(CASE WHEN {column} IS NULL THEN NULL {' '.join(cases)} END)"
+
+
+def init_database(path=DB_TEMP_NAME):
     """Initialize the database by creating tables, indexes, and populating initial data."""
-    global con, cur
+    global con, cur, duplicate_links
 
-    if os.path.exists(DB_TEMP_NAME):
-        os.remove(DB_TEMP_NAME)
+    if os.path.exists(path):
+        os.remove(path)
 
-    con = sqlite3.connect(DB_TEMP_NAME)
+    con = sqlite3.connect(path)
     cur = con.cursor()
 
     # Enable FTS5
     cur.execute('PRAGMA foreign_keys = ON;')
+    cur.execute(f'PRAGMA user_version = {SCHEMA_VERSION};')
 
     cur.execute('''
         CREATE TABLE platforms (
@@ -96,7 +172,8 @@ def init_database():
 
     cur.execute('''
         CREATE TABLE entries (
-            slug TEXT PRIMARY KEY,
+            id INTEGER PRIMARY KEY,
+            slug TEXT UNIQUE,
             rom_id TEXT,
             search_key TEXT,
             title TEXT,
@@ -106,12 +183,28 @@ def init_database():
         )
     ''')
 
+    # Substring index of the search keys. Without positions and column sizes, which are only used
+    # for ranking, the index is about half the size, and candidates are checked against the search key
     cur.execute('''
         CREATE VIRTUAL TABLE entries_fts USING fts5(
             search_key,
             content='entries',
-            content_rowid='rowid',
-            tokenize='trigram'
+            content_rowid='id',
+            tokenize='trigram',
+            detail='none',
+            columnsize=0
+        )
+    ''')
+
+    # Word index of the titles and ROM IDs, with prefix indexes for short queries and ranking
+    cur.execute('''
+        CREATE VIRTUAL TABLE entries_title_fts USING fts5(
+            title,
+            rom_id,
+            content='entries',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
         )
     ''')
 
@@ -124,35 +217,122 @@ def init_database():
 
     cur.execute('''
         CREATE TABLE regions_entries (
-            entry TEXT,
+            entry INTEGER,
             region TEXT,
-            FOREIGN KEY (entry) REFERENCES entries (slug),
+            PRIMARY KEY (entry, region),
+            FOREIGN KEY (entry) REFERENCES entries (id),
             FOREIGN KEY (region) REFERENCES regions (id)
-        )
+        ) WITHOUT ROWID
     ''')
 
+    for table in LINK_LOOKUP_TABLES.values():
+        cur.execute(f'''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY,
+                value TEXT UNIQUE
+            )
+        ''')
+
+    # The size string is only stored when it differs from the one derived from the size
     cur.execute('''
-        CREATE TABLE links (
-            entry TEXT,
+        CREATE TABLE entry_links (
+            entry INTEGER,
             name TEXT,
-            type TEXT,
-            format TEXT,
+            type INTEGER,
+            format INTEGER,
             url TEXT,
             filename TEXT,
-            host TEXT,
+            host INTEGER,
             size INTEGER,
             size_str TEXT,
-            source_url TEXT,
-            FOREIGN KEY (entry) REFERENCES entries (slug)
+            source_url INTEGER,
+            UNIQUE (entry, url),
+            FOREIGN KEY (entry) REFERENCES entries (id),
+            FOREIGN KEY (type) REFERENCES link_types (id),
+            FOREIGN KEY (format) REFERENCES link_formats (id),
+            FOREIGN KEY (host) REFERENCES link_hosts (id),
+            FOREIGN KEY (source_url) REFERENCES link_source_urls (id)
         )
     ''')
 
-    cur.execute('CREATE INDEX idx_entries_platform ON entries (platform);')
-    cur.execute(
-        'CREATE INDEX idx_regions_entries_entry ON regions_entries (entry);')
+    # Decoded view with the same columns as the links table had before encoding. Links reference
+    # entries by ID, so the slug they were keyed by before is given as entry_slug to port old queries.
+    # The entry is left joined on its primary key, so queries not reading its slug skip the join
+    cur.execute(f'''
+        CREATE VIEW links AS
+        SELECT
+            l.entry,
+            e.slug AS entry_slug,
+            l.name,
+            t.value AS type,
+            f.value AS format,
+            l.url,
+            l.filename,
+            h.value AS host,
+            l.size,
+            COALESCE(l.size_str, {get_size_str_sql('l.size')}) AS size_str,
+            s.value AS source_url
+        FROM entry_links l
+        LEFT JOIN entries e ON e.id = l.entry
+        LEFT JOIN link_types t ON t.id = l.type
+        LEFT JOIN link_formats f ON f.id = l.format
+        LEFT JOIN link_hosts h ON h.id = l.host
+        LEFT JOIN link_source_urls s ON s.id = l.source_url
+    ''')
+
+    # Vocabulary of the word index, read from the index itself without storing anything
+    cur.execute("CREATE VIRTUAL TABLE entries_title_vocab USING fts5vocab(entries_title_fts, 'col')")
+
+    # Words of the titles with their number of entries, and the trigrams of each word padded with
+    # spaces. Misspelled words are matched to the words sharing most of their trigrams
+    cur.execute('''
+        CREATE TABLE title_words (
+            id INTEGER PRIMARY KEY,
+            word TEXT UNIQUE,
+            entries INTEGER
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE title_word_trigrams (
+            trigram TEXT,
+            word INTEGER,
+            PRIMARY KEY (trigram, word),
+            FOREIGN KEY (word) REFERENCES title_words (id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Number of entries and links for each combination of facet values, including any value
+    cur.execute(f'''
+        CREATE TABLE facet_counts (
+            {", ".join(f"{dimension} TEXT" for dimension in FACET_DIMENSIONS)},
+            entries INTEGER,
+            links INTEGER,
+            PRIMARY KEY ({", ".join(FACET_DIMENSIONS)})
+        ) WITHOUT ROWID
+    ''')
+
+    # Regions, links and link summary of each entry as JSON, to read them in a single lookup
+    cur.execute('''
+        CREATE TABLE entry_details (
+            entry INTEGER PRIMARY KEY,
+            regions TEXT,
+            links TEXT,
+            link_summary TEXT,
+            FOREIGN KEY (entry) REFERENCES entries (id)
+        )
+    ''')
+
+    # Entries are looked up by slug through the index of its UNIQUE constraint, regions by
+    # entry through the primary key of regions_entries and links by entry through the index
+    # of their UNIQUE constraint. Entries are listed by title, within a platform or across all of them
+    cur.execute('CREATE INDEX idx_entries_platform ON entries (platform, title);')
+    cur.execute('CREATE INDEX idx_entries_title ON entries (title);')
     cur.execute(
         'CREATE INDEX idx_regions_entries_region ON regions_entries (region);')
-    cur.execute('CREATE INDEX idx_links_entry ON links (entry);')
+
+    lookup_ids.clear()
+    duplicate_links = 0
 
     for id, info in PLATFORMS.items():
         cur.execute('INSERT INTO platforms (id, brand, name) VALUES (?, ?, ?)',
@@ -162,16 +342,74 @@ def init_database():
         cur.execute('INSERT INTO regions (id, name) VALUES (?, ?)', (id, name))
 
 
+def get_lookup_id(table, value):
+    """Retrieve the ID of a link attribute value in a lookup table, inserting the value if new."""
+    if value is None:
+        return None
+
+    ids = lookup_ids.setdefault(table, {})
+    if value not in ids:
+        # The value may have been inserted by a shard merge already
+        cur.execute(f'INSERT OR IGNORE INTO {table} (value) VALUES (?)', (value,))
+        ids[value] = cur.execute(
+            f'SELECT id FROM {table} WHERE value = ?', (value,)).fetchone()[0]
+    return ids[value]
+
+
+def insert_links(entry_id, links):
+    """Insert the links of an entry, encoding their repeated attributes and skipping duplicate URLs."""
+    global duplicate_links
+
+    for link in links:
+        # Only keep the size string when it cannot be derived from the size
+        size = link.get('size')
+        size_str = link.get('size_str')
+        if isinstance(size, int) and 0 <= size < MAX_DERIVED_SIZE and size_str == size_bytes_to_str(size):
+            size_str = None
+
+        cur.execute('''
+            INSERT OR IGNORE INTO entry_links (entry, name, type, format, url, filename, host, size, size_str, source_url)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            entry_id,
+            link.get('name'),
+            get_lookup_id(LINK_LOOKUP_TABLES['type'], link.get('type')),
+            get_lookup_id(LINK_LOOKUP_TABLES['format'], link.get('format')),
+            link.get('url'),
+            link.get('filename'),
+            get_lookup_id(LINK_LOOKUP_TABLES['host'], link.get('host')),
+            size,
+            size_str,
+            get_lookup_id(LINK_LOOKUP_TABLES['source_url'], link.get('source_url'))
+        ))
+
+        # Nothing is inserted when the entry already has a link with the same URL
+        if cur.rowcount == 0:
+            duplicate_links += 1
+
+
+def insert_entries(entries):
+    """Insert multiple entries into the database, creating their slugs and search keys in a batch."""
+    for entry, (slug, search_key) in zip(entries, create_slugs_and_keys(entries)):
+        entry['slug'] = slug
+        entry['search_key'] = search_key
+        insert_entry(entry)
+
+
 def insert_entry(entry: dict):
     """Insert a new entry into the database or update it if it exists."""
-    entry['slug'] = create_slug(entry)
-    entry['search_key'] = create_search_key(entry['title'])
+    if 'slug' not in entry:
+        entry['slug'] = create_slug(entry)
+    if 'search_key' not in entry:
+        entry['search_key'] = create_search_key(entry['title'])
 
     # Check if an entry with the same slug exists
-    cur.execute("SELECT slug FROM entries WHERE slug = ?", (entry['slug'],))
+    cur.execute("SELECT id FROM entries WHERE slug = ?", (entry['slug'],))
     existing_entry = cur.fetchone()
 
     if existing_entry:
+        entry_id = existing_entry[0]
+
         # Update fields where they are NULL
         cur.execute('''
             UPDATE entries
@@ -180,33 +418,18 @@ def insert_entry(entry: dict):
                 title = COALESCE(title, ?),
                 platform = COALESCE(platform, ?),
                 boxart_url = COALESCE(boxart_url, ?)
-            WHERE slug = ?
+            WHERE id = ?
         ''', (
             entry.get('rom_id'),
             entry.get('search_key'),
             entry.get('title'),
             entry.get('platform'),
             entry.get('boxart_url'),
-            entry['slug']
+            entry_id
         ))
 
         # Add new links
-        for link in entry.get('links', []):
-            cur.execute('''
-                INSERT OR IGNORE INTO links (entry, name, type, format, url, filename, host, size, size_str, source_url)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                entry.get('slug'),
-                link.get('name'),
-                link.get('type'),
-                link.get('format'),
-                link.get('url'),
-                link.get('filename'),
-                link.get('host'),
-                link.get('size'),
-                link.get('size_str'),
-                link.get('source_url')
-            ))
+        insert_links(entry_id, entry.get('links', []))
     else:
         # Insert the new entry into the entries table
         cur.execute('''
@@ -220,48 +443,247 @@ def insert_entry(entry: dict):
             entry.get('platform'),
             entry.get('boxart_url')
         ))
-
-        # Insert into the FTS5 table
-        cur.execute('''
-            INSERT INTO entries_fts (rowid, search_key)
-            VALUES (last_insert_rowid(), ?)
-        ''', (entry['search_key'],))
+        entry_id = cur.lastrowid
 
         # Insert regions into the regions_entries table
         for region in entry.get('regions', []):
             cur.execute('''
                 INSERT OR IGNORE INTO regions_entries (entry, region)
                 VALUES (?, ?)
-            ''', (entry.get('slug'), region))
+            ''', (entry_id, region))
 
         # Insert links into the links table
-        for link in entry.get('links', []):
-            cur.execute('''
-                INSERT INTO links (entry, name, type, format, url, filename, host, size, size_str, source_url)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                entry.get('slug'),
-                link.get('name'),
-                link.get('type'),
-                link.get('format'),
-                link.get('url'),
-                link.get('filename'),
-                link.get('host'),
-                link.get('size'),
-                link.get('size_str'),
-                link.get('source_url')
-            ))
-
-
-def close_database():
-    """Close the database connection and finalize changes."""
+        insert_links(entry_id, entry.get('links', []))
+
+
+def get_shard_path(name):
+    """Retrieve the path of a shard database by its name."""
+    return os.path.join(SHARDS_DIR, f'{name}.db')
+
+
+def close_shard():
+    """Commit and close a shard database, leaving it in place to be merged."""
+    # Statistics of the shard, read back when merging it
+    cur.execute('''
+        CREATE TABLE shard_stats (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    ''')
+    cur.execute("INSERT INTO shard_stats (key, value) VALUES ('duplicate_links', ?)",
+                (duplicate_links,))
+    con.commit()
+
+    cur.close()
+    con.close()
+
+
+def merge_shard(path):
+    """Merge a shard database into the database, with the same semantics as inserting its entries.
+
+    Entries colliding on their slug only fill the fields that are NULL, and links are
+    de-duplicated on their entry and URL. Entries keep the order they had in the shard.
+    The full-text indexes are built once all shards are merged, when closing the database.
+    """
+    global duplicate_links
+
+    cur.execute('ATTACH DATABASE ? AS shard', (path,))
+
+    cur.execute('''
+        INSERT INTO entries (slug, rom_id, search_key, title, platform, boxart_url)
+        SELECT slug, rom_id, search_key, title, platform, boxart_url
+        FROM shard.entries
+        WHERE true
+        ORDER BY id
+        ON CONFLICT (slug) DO UPDATE
+        SET rom_id = COALESCE(rom_id, excluded.rom_id),
+            search_key = COALESCE(search_key, excluded.search_key),
+            title = COALESCE(title, excluded.title),
+            platform = COALESCE(platform, excluded.platform),
+            boxart_url = COALESCE(boxart_url, excluded.boxart_url)
+    ''')
+
+    cur.execute('''
+        INSERT OR IGNORE INTO regions_entries (entry, region)
+        SELECT e.id, r.region
+        FROM shard.regions_entries r
+        JOIN shard.entries s ON s.id = r.entry
+        JOIN entries e ON e.slug = s.slug
+        ORDER BY s.id
+    ''')
+
+    for table in LINK_LOOKUP_TABLES.values():
+        cur.execute(f'INSERT OR IGNORE INTO {table} (value) SELECT value FROM shard.{table} ORDER BY id')
+
+    cur.execute('''
+        INSERT OR IGNORE INTO entry_links (entry, name, type, format, url, filename, host, size, size_str, source_url)
+        SELECT e.id, l.name, t.id, f.id, l.url, l.filename, h.id, l.size, l.size_str, su.id
+        FROM shard.entry_links l
+        JOIN shard.entries s ON s.id = l.entry
+        JOIN entries e ON e.slug = s.slug
+        LEFT JOIN shard.link_types st ON st.id = l.type
+        LEFT JOIN link_types t ON t.value = st.value
+        LEFT JOIN shard.link_formats sf ON sf.id = l.format
+        LEFT JOIN link_formats f ON f.value = sf.value
+        LEFT JOIN shard.link_hosts sh ON sh.id = l.host
+        LEFT JOIN link_hosts h ON h.value = sh.value
+        LEFT JOIN shard.link_source_urls ssu ON ssu.id = l.source_url
+        LEFT JOIN link_source_urls su ON su.value = ssu.value
+        ORDER BY l.rowid
+    ''')
+    inserted_links = cur.rowcount
+    shard_links = cur.execute('SELECT COUNT(*) FROM shard.entry_links').fetchone()[0]
+    shard_duplicate_links = cur.execute(
+        "SELECT value FROM shard.shard_stats WHERE key = 'duplicate_links'").fetchone()[0]
+    duplicate_links += shard_duplicate_links + shard_links - inserted_links
+
+    con.commit()
+    cur.execute('DETACH DATABASE shard')
+
+    # Lookup IDs inserted by the merge are not known to the in-memory map
+    lookup_ids.clear()
+
+
+def rebuild_fts():
+    """Build the full-text indexes from all the entries at once."""
+    for table in FTS_TABLES:
+        cur.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+
+def get_similarity_statements():
+    """Build the SQL statements computing the similarity index from the vocabulary of the word index."""
+    return [
+        'DELETE FROM title_word_trigrams',
+        'DELETE FROM title_words',
+        # Numbers are left out, as a misspelled number cannot be told apart from another number
+        f'''
+            INSERT INTO title_words (word, entries)
+            SELECT term, doc FROM entries_title_vocab
+            WHERE col = 'title' AND length(term) >= {MIN_SIMILAR_WORD_LENGTH} AND term GLOB '*[^0-9]*'
+            ORDER BY term
+        ''',
+        '''
+            INSERT OR IGNORE INTO title_word_trigrams (trigram, word)
+            WITH RECURSIVE positions (word, padded, position) AS (
+                SELECT id, ' ' || word || ' ', 1 FROM title_words
+                UNION ALL
+                SELECT word, padded, position + 1 FROM positions
+                WHERE position + 3 <= length(padded)
+            )
+            SELECT substr(padded, position, 3), word FROM positions
+        '''
+    ]
+
+
+def build_similarity_index():
+    """Compute the similarity index of the title words once the word index is built."""
+    for statement in get_similarity_statements():
+        cur.execute(statement)
+
+
+def get_facet_statements():
+    """Build the SQL statements computing the facet counts from the entries, regions and links."""
+    columns = ", ".join(f"{expression} AS {dimension}" for dimension, expression in FACET_DIMENSIONS.items())
+    statements = [
+        'DELETE FROM facet_counts',
+        'DROP TABLE IF EXISTS temp.facet_rows',
+        f'''
+            CREATE TEMP TABLE facet_rows AS
+            SELECT e.id AS entry, l.rowid AS link, {columns}
+            FROM entries e
+            LEFT JOIN regions_entries r ON r.entry = e.id
+            LEFT JOIN entry_links l ON l.entry = e.id
+            LEFT JOIN link_hosts h ON h.id = l.host
+            LEFT JOIN link_types t ON t.id = l.type
+        '''
+    ]
+
+    # One grouping for each subset of dimensions, the others counting any value
+    for size in range(len(FACET_DIMENSIONS) + 1):
+        for grouped in combinations(FACET_DIMENSIONS, size):
+            values = [dimension if dimension in grouped else f"'{ANY_FACET_VALUE}'"
+                      for dimension in FACET_DIMENSIONS]
+            conditions = [f'{dimension} IS NOT NULL' for dimension in grouped]
+            statements.append(f'''
+                INSERT INTO facet_counts ({", ".join(FACET_DIMENSIONS)}, entries, links)
+                SELECT {", ".join(values)}, COUNT(DISTINCT entry), COUNT(DISTINCT link)
+                FROM temp.facet_rows
+                {f"WHERE {' AND '.join(conditions)}" if conditions else ""}
+                {f"GROUP BY {', '.join(grouped)}" if grouped else ""}
+            ''')
+
+    statements.append('DROP TABLE temp.facet_rows')
+    return statements
+
+
+def build_facets():
+    """Compute the facet counts once all entries are in the database."""
+    for statement in get_facet_statements():
+        cur.execute(statement)
+
+
+def get_entry_details_statement(condition='1'):
+    """Build the SQL statement computing the details of the entries matching a condition on `e`."""
+    return f'''
+        INSERT OR REPLACE INTO entry_details (entry, regions, links, link_summary)
+        SELECT
+            e.id,
+            (
+                SELECT json_group_array(region) FROM (
+                    SELECT region FROM regions_entries WHERE entry = e.id ORDER BY {REGIONS_ORDER}
+                )
+            ),
+            (
+                SELECT json_group_array(json_object(
+                    'name', name,
+                    'type', type,
+                    'format', format,
+                    'url', url,
+                    'filename', filename,
+                    'host', host,
+                    'size', size,
+                    'size_str', size_str,
+                    'source_url', source_url
+                )) FROM (
+                    SELECT * FROM links WHERE entry = e.id ORDER BY {LINKS_ORDER}
+                )
+            ),
+            (
+                SELECT json_object(
+                    'links', COUNT(*),
+                    'size', COALESCE(SUM(size), 0),
+                    'hosts', json_group_array(DISTINCT host) FILTER (WHERE host IS NOT NULL),
+                    'formats', json_group_array(DISTINCT format) FILTER (WHERE format IS NOT NULL)
+                ) FROM (
+                    SELECT host, format, size FROM links WHERE entry = e.id ORDER BY host, format
+                )
+            )
+        FROM entries e
+        WHERE {condition}
+    '''
+
+
+def build_entry_details():
+    """Compute the details of all entries once they are in the database."""
+    cur.execute('DELETE FROM entry_details')
+    cur.execute(get_entry_details_statement())
+
+
+def get_platform_sizes():
+    """Retrieve the number of entries of each platform."""
+    return dict(cur.execute('SELECT platform, COUNT(*) FROM entries GROUP BY platform').fetchall())
+
+
+def close_database(entry_details=True, path=DB_NAME):
+    """Close the database connection and finalize changes into the given path, optionally computing the entry details."""
+    rebuild_fts()
+    build_similarity_index()
+    build_facets()
+    if entry_details:
+        build_entry_details()
     con.commit()
 
     cur.close()
     con.close()
 
-    if os.path.exists(DB_NAME):
-        if os.path.exists(DB_OLD_NAME):
-            os.remove(DB_OLD_NAME)
-        os.rename(DB_NAME, DB_OLD_NAME)
-    os.rename(DB_TEMP_NAME, DB_NAME)
+    os.replace(DB_TEMP_NAME, path)
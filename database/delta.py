@@ -0,0 +1,282 @@
+"""
+This module provides functionality for creating and applying deltas between two builds of the
+ROMs database, so a deployed copy can be updated without shipping the whole database.
+
+A delta is a gzip compressed file of JSON lines, diffing the builds by entry slug and link URL.
+Its first line is a header with the schema version and the fingerprints of both builds, and each
+following line is one change. Fingerprints do not depend on row IDs, so a copy patched with a delta
+is checked against the build the delta was created from.
+"""
+import gzip
+import hashlib
+import json
+import sqlite3
+from database import db_manager
+
+DELTA_NAME = 'roms_delta.jsonl.gz'
+
+# Columns of an entry, besides its slug
+ENTRY_COLUMNS = ('rom_id', 'search_key', 'title', 'platform', 'boxart_url')
+
+# Columns of a link, besides its entry and URL, with their attributes decoded
+LINK_COLUMNS = ('name', 'type', 'format', 'filename', 'host', 'size', 'size_str', 'source_url')
+
+# Query retrieving the links of all entries with their stored size string and decoded attributes
+DECODED_LINKS_QUERY = '''
+    SELECT e.slug, l.url, l.name, t.value, f.value, l.filename, h.value, l.size, l.size_str, s.value
+    FROM {db}.entry_links l
+    JOIN {db}.entries e ON e.id = l.entry
+    LEFT JOIN {db}.link_types t ON t.id = l.type
+    LEFT JOIN {db}.link_formats f ON f.id = l.format
+    LEFT JOIN {db}.link_hosts h ON h.id = l.host
+    LEFT JOIN {db}.link_source_urls s ON s.id = l.source_url
+'''
+
+
+def get_schema_version(path):
+    """Retrieve the schema version of a database."""
+    con = sqlite3.connect(path)
+    version = con.execute('PRAGMA user_version').fetchone()[0]
+    con.close()
+    return version
+
+
+def get_fingerprint(cur, db='main'):
+    """Compute a hash of the entries, regions and links of a database, independent of row IDs."""
+    digest = hashlib.sha1()
+
+    queries = [
+        f'SELECT slug, {", ".join(ENTRY_COLUMNS)} FROM {db}.entries ORDER BY slug',
+        f'''
+            SELECT e.slug, r.region
+            FROM {db}.regions_entries r JOIN {db}.entries e ON e.id = r.entry
+            ORDER BY e.slug, r.region
+        ''',
+        DECODED_LINKS_QUERY.format(db=db) + ' ORDER BY e.slug, l.url'
+    ]
+    for query in queries:
+        for row in cur.execute(query):
+            digest.update(json.dumps(row).encode())
+        digest.update(b'\n')
+
+    return digest.hexdigest()
+
+
+def create_delta(old_path, new_path, delta_path):
+    """Create a delta from one build of the database to another.
+
+    Returns the number of changes in the delta.
+    """
+    con = sqlite3.connect(new_path)
+    cur = con.cursor()
+    cur.execute('ATTACH DATABASE ? AS old', (old_path,))
+
+    changes = []
+
+    # Entries removed from the old build, along with their regions and links
+    for (slug,) in cur.execute('SELECT slug FROM old.entries EXCEPT SELECT slug FROM main.entries'):
+        changes.append({'op': 'delete_entry', 'slug': slug})
+
+    # Entries added or changed in the new build
+    columns = ', '.join(('slug',) + ENTRY_COLUMNS)
+    for row in cur.execute(f'SELECT {columns} FROM main.entries EXCEPT SELECT {columns} FROM old.entries'):
+        changes.append({'op': 'upsert_entry', 'slug': row[0],
+                        **dict(zip(ENTRY_COLUMNS, row[1:]))})
+
+    # Regions and links removed from entries kept in the new build
+    regions_query = '''
+        SELECT e.slug, r.region
+        FROM {db}.regions_entries r JOIN {db}.entries e ON e.id = r.entry
+    '''
+    kept_filter = ' WHERE e.slug IN (SELECT slug FROM main.entries)'
+    for slug, region in cur.execute(regions_query.format(db='old') + kept_filter +
+                                    ' EXCEPT ' + regions_query.format(db='main')):
+        changes.append({'op': 'delete_region', 'slug': slug, 'region': region})
+
+    link_keys_query = 'SELECT e.slug, l.url FROM {db}.entry_links l JOIN {db}.entries e ON e.id = l.entry'
+    for slug, url in cur.execute(link_keys_query.format(db='old') + kept_filter +
+                                 ' EXCEPT ' + link_keys_query.format(db='main')):
+        changes.append({'op': 'delete_link', 'slug': slug, 'url': url})
+
+    # Regions and links added or changed in the new build
+    for slug, region in cur.execute(regions_query.format(db='main') + ' EXCEPT ' + regions_query.format(db='old')):
+        changes.append({'op': 'add_region', 'slug': slug, 'region': region})
+
+    for row in cur.execute(DECODED_LINKS_QUERY.format(db='main') + ' EXCEPT ' + DECODED_LINKS_QUERY.format(db='old')):
+        changes.append({'op': 'upsert_link', 'slug': row[0], 'url': row[1],
+                        **dict(zip(LINK_COLUMNS, row[2:]))})
+
+    header = {
+        'schema_version': db_manager.SCHEMA_VERSION,
+        'base': get_fingerprint(cur, 'old'),
+        'target': get_fingerprint(cur, 'main'),
+        'changes': len(changes)
+    }
+
+    cur.close()
+    con.close()
+
+    with gzip.open(delta_path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps(header) + '\n')
+        for change in changes:
+            f.write(json.dumps(change, separators=(',', ':')) + '\n')
+
+    return len(changes)
+
+
+def read_delta(delta_path):
+    """Read the header and the changes of a delta."""
+    with gzip.open(delta_path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        changes = [json.loads(line) for line in f]
+    return header, changes
+
+
+def get_entry(cur, slug):
+    """Retrieve the ID of an entry by its slug, as a one-element tuple, or None if it does not exist."""
+    return cur.execute('SELECT id FROM entries WHERE slug = ?', (slug,)).fetchone()
+
+
+def get_value_id(cur, table, value):
+    """Retrieve the ID of a link attribute value in a lookup table, inserting the value if new."""
+    if value is None:
+        return None
+
+    cur.execute(f'INSERT OR IGNORE INTO {table} (value) VALUES (?)', (value,))
+    return cur.execute(f'SELECT id FROM {table} WHERE value = ?', (value,)).fetchone()[0]
+
+
+def index_entry(cur, entry_id, delete=False):
+    """Add an entry to the full-text indexes, or remove it with the values it was indexed with."""
+    for table, columns in db_manager.FTS_TABLES.items():
+        values = cur.execute(f'SELECT {", ".join(columns)} FROM entries WHERE id = ?',
+                             (entry_id,)).fetchone()
+        placeholders = ", ".join("?" * len(columns))
+
+        if delete:
+            cur.execute(f"INSERT INTO {table} ({table}, rowid, {', '.join(columns)}) VALUES ('delete', ?, {placeholders})",
+                        (entry_id, *values))
+        else:
+            cur.execute(f'INSERT INTO {table} (rowid, {", ".join(columns)}) VALUES (?, {placeholders})',
+                        (entry_id, *values))
+
+
+def delete_entry(cur, change):
+    """Delete an entry with its regions and links, removing it from the full-text indexes."""
+    entry = get_entry(cur, change['slug'])
+    if not entry:
+        return
+
+    entry_id = entry[0]
+    index_entry(cur, entry_id, delete=True)
+    cur.execute('DELETE FROM entry_details WHERE entry = ?', (entry_id,))
+    cur.execute('DELETE FROM entry_links WHERE entry = ?', (entry_id,))
+    cur.execute('DELETE FROM regions_entries WHERE entry = ?', (entry_id,))
+    cur.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
+
+
+def upsert_entry(cur, change):
+    """Insert or update an entry, updating its rows in the full-text indexes."""
+    values = [change[column] for column in ENTRY_COLUMNS]
+    entry = get_entry(cur, change['slug'])
+
+    if entry:
+        entry_id = entry[0]
+        index_entry(cur, entry_id, delete=True)
+        cur.execute(f'''
+            UPDATE entries SET {", ".join(f"{column} = ?" for column in ENTRY_COLUMNS)}
+            WHERE id = ?
+        ''', (*values, entry_id))
+    else:
+        cur.execute(f'''
+            INSERT INTO entries (slug, {", ".join(ENTRY_COLUMNS)})
+            VALUES (?, {", ".join("?" * len(ENTRY_COLUMNS))})
+        ''', (change['slug'], *values))
+        entry_id = cur.lastrowid
+
+    index_entry(cur, entry_id)
+
+
+def apply_change(cur, change):
+    """Apply a single change of a delta."""
+    op = change['op']
+    if op == 'delete_entry':
+        delete_entry(cur, change)
+        return
+    if op == 'upsert_entry':
+        upsert_entry(cur, change)
+        return
+
+    entry_id = get_entry(cur, change['slug'])[0]
+    if op == 'delete_region':
+        cur.execute('DELETE FROM regions_entries WHERE entry = ? AND region = ?',
+                    (entry_id, change['region']))
+    elif op == 'add_region':
+        cur.execute('INSERT OR IGNORE INTO regions_entries (entry, region) VALUES (?, ?)',
+                    (entry_id, change['region']))
+    elif op == 'delete_link':
+        cur.execute('DELETE FROM entry_links WHERE entry = ? AND url = ?',
+                    (entry_id, change['url']))
+    elif op == 'upsert_link':
+        cur.execute('''
+            INSERT OR REPLACE INTO entry_links (entry, name, type, format, url, filename, host, size, size_str, source_url)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            entry_id,
+            change['name'],
+            get_value_id(cur, db_manager.LINK_LOOKUP_TABLES['type'], change['type']),
+            get_value_id(cur, db_manager.LINK_LOOKUP_TABLES['format'], change['format']),
+            change['url'],
+            change['filename'],
+            get_value_id(cur, db_manager.LINK_LOOKUP_TABLES['host'], change['host']),
+            change['size'],
+            change['size_str'],
+            get_value_id(cur, db_manager.LINK_LOOKUP_TABLES['source_url'], change['source_url'])
+        ))
+    else:
+        raise ValueError(f"Unknown delta operation '{op}'")
+
+
+def apply_delta(delta_path, db_path):
+    """Apply a delta to a copy of the database, in a single transaction.
+
+    The copy has to match the build the delta was created from, and is checked to match
+    the build the delta leads to before committing.
+    """
+    header, changes = read_delta(delta_path)
+
+    con = sqlite3.connect(db_path)
+    cur = con.cursor()
+
+    if cur.execute('PRAGMA user_version').fetchone()[0] != header['schema_version']:
+        con.close()
+        raise ValueError("Database schema version does not match the delta")
+    if get_fingerprint(cur) != header['base']:
+        con.close()
+        raise ValueError("Database does not match the base build of the delta")
+
+    # Entry details are only kept up to date if the build computed them
+    has_entry_details = cur.execute('SELECT 1 FROM entry_details LIMIT 1').fetchone() is not None
+
+    for change in changes:
+        apply_change(cur, change)
+
+    # Facet counts and the similarity index are computed again rather than patched
+    for statement in db_manager.get_similarity_statements() + db_manager.get_facet_statements():
+        cur.execute(statement)
+
+    if has_entry_details:
+        changed_slugs = sorted({change['slug'] for change in changes if change['op'] != 'delete_entry'})
+        cur.execute(db_manager.get_entry_details_statement('e.slug IN (SELECT value FROM json_each(?))'),
+                    (json.dumps(changed_slugs),))
+
+    if get_fingerprint(cur) != header['target']:
+        con.rollback()
+        con.close()
+        raise ValueError("Database does not match the target build of the delta after applying it")
+
+    con.commit()
+    cur.close()
+    con.close()
+
+    return len(changes)
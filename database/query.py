@@ -0,0 +1,467 @@
+"""
+This module provides a read API over the ROMs database, for consumers that need to search and
+display entries without writing their own SQL against the schema.
+
+The database is opened read-only and immutable, with its file memory-mapped, as a built database
+never changes. Builds are published as new files, which are detected and switched to. A database
+must not be patched in place while it is read: deltas are applied to a copy, which is then linked
+or moved in. Queries are built from a fixed set of SQL strings, so their prepared statements are
+reused from the connection's statement cache, and the results of the most recent searches are kept
+in a bounded LRU cache, keyed by the build they were read from.
+
+Searches pick one of the two full-text indexes: a single word of at least 3 characters is matched
+anywhere in the search keys with the trigram index, while several words or a shorter word are matched
+as word prefixes of the titles and ROM IDs with the word index, several words being ranked with bm25.
+
+Misspelled queries are handled by a fuzzy search, which replaces each word with the closest title
+words found through their shared trigrams, then ranks the titles matching them by similarity.
+"""
+import json
+import os
+import re
+import sqlite3
+import time
+from difflib import SequenceMatcher
+from functools import lru_cache, wraps
+from database import db_manager
+from utils.parse_utils import create_search_key, normalize_title
+
+# Size of the memory map of the database file (in bytes)
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Interval between checks for a newly published database (in seconds)
+RELOAD_CHECK_INTERVAL = 1.0
+
+# Number of prepared statements kept by the connection
+STATEMENTS_CACHE_SIZE = 256
+
+# Number of search results kept in the LRU cache
+QUERY_CACHE_SIZE = 1024
+
+# Number of entries per page of results, by default and at most
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Minimum length of a search key matched with the trigram index, shorter ones use the word index
+MIN_TRIGRAM_KEY_LENGTH = 3
+
+# Weights of the title and ROM ID columns when ranking matches of the word index
+TITLE_FTS_WEIGHTS = (10.0, 1.0)
+
+# Pattern matching the words of a query
+QUERY_WORD_PATTERN = re.compile(r'[^\W_]+')
+
+# Condition matching the words of a query with the word index
+TITLE_MATCH_CONDITION = 'entries_title_fts MATCH ?'
+
+# Number of entries returned by a fuzzy search, by default and at most
+DEFAULT_FUZZY_LIMIT = 10
+MAX_FUZZY_LIMIT = 50
+
+# Number of title words compared with each word of a fuzzy search, and the most similar ones kept
+FUZZY_WORD_CANDIDATES = 50
+FUZZY_WORD_CORRECTIONS = 3
+
+# Maximum difference in length between a word of a fuzzy search and the title words it is compared with
+MAX_FUZZY_LENGTH_DIFFERENCE = 2
+
+# Minimum similarity of a title word to a word of a fuzzy search, from 0 to 1
+MIN_FUZZY_WORD_SIMILARITY = 0.7
+
+# Number of entries matching the corrected words that are ranked by similarity to the query
+FUZZY_TITLE_CANDIDATES = 200
+
+ENTRY_COLUMNS = ('id', 'slug', 'rom_id', 'title', 'platform', 'boxart_url')
+
+LINK_COLUMNS = ('name', 'type', 'format', 'url', 'filename', 'host', 'size', 'size_str', 'source_url')
+
+# Connection to the database, opened on first use
+con = None
+
+# Path the database was opened from, the build it resolved to, and the last time it was resolved again
+db_path = None
+db_build = None
+last_reload_check = 0.0
+
+# Whether the database has its entry details computed
+has_entry_details = False
+
+
+def get_build(path):
+    """Identify the build of the database at a path, as the file it resolves to and its modification time."""
+    real_path = os.path.realpath(path)
+    return real_path, os.stat(real_path).st_mtime_ns
+
+
+def open_database(path=db_manager.DB_NAME):
+    """Open the database read-only, replacing the current connection.
+
+    Links in the path are resolved, so the connection keeps reading the same build until a new one
+    is published at the path. The previous connection is not closed, as other threads may still be
+    reading from it, and is closed once it is not used anymore. Cached results are kept, as they
+    are keyed by build.
+    """
+    global con, has_entry_details, db_path, db_build, last_reload_check
+    build = get_build(path)
+    real_path = build[0]
+
+    # The new connection is ready before it replaces the previous one
+    new_con = sqlite3.connect(f'file:{real_path}?mode=ro&immutable=1', uri=True,
+                              cached_statements=STATEMENTS_CACHE_SIZE, check_same_thread=False)
+    new_con.execute(f'PRAGMA mmap_size = {MMAP_SIZE};')
+    new_has_entry_details = new_con.execute('SELECT 1 FROM entry_details LIMIT 1').fetchone() is not None
+
+    # The build is switched last, so results cached for it are always read from its connection
+    con = new_con
+    has_entry_details = new_has_entry_details
+    db_path = path
+    db_build = build
+    last_reload_check = time.monotonic()
+    return con
+
+
+def close_database():
+    """Close the connection to the database and clear cached results."""
+    global con
+    if con is not None:
+        con.close()
+        con = None
+
+    search.cache_clear()
+    fuzzy_search.cache_clear()
+    get_entry.cache_clear()
+
+
+def get_connection():
+    """Retrieve the connection to the database, opening it if needed or if a new build was published."""
+    global last_reload_check
+
+    if con is None:
+        open_database()
+    elif time.monotonic() - last_reload_check >= RELOAD_CHECK_INTERVAL:
+        last_reload_check = time.monotonic()
+        if get_build(db_path) != db_build:
+            open_database(db_path)
+
+    return con
+
+
+def cached_per_build(function):
+    """Decorate a query function to cache its results in an LRU cache keyed by the build they are read from.
+
+    A newly published database is switched to before reading the cache, and results still being read
+    from the previous build by other threads are cached for that build only.
+    """
+    @lru_cache(maxsize=QUERY_CACHE_SIZE)
+    def cached_function(build, *args, **kwargs):
+        return function(*args, **kwargs)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        get_connection()
+        return cached_function(db_build, *args, **kwargs)
+
+    wrapper.cache_clear = cached_function.cache_clear
+    wrapper.cache_info = cached_function.cache_info
+    return wrapper
+
+
+def build_filters(query, platforms, regions):
+    """Build the SQL tables, conditions, parameters and ordering of a search by query, platforms and regions."""
+    tables = 'entries e'
+    conditions = []
+    params = []
+    order = 'e.title, e.id'
+
+    words = QUERY_WORD_PATTERN.findall(query.lower())
+    search_key = create_search_key(query)
+
+    if len(words) > 1 or 0 < len(search_key) < MIN_TRIGRAM_KEY_LENGTH:
+        # Words only contain letters and digits, so they are safe to quote as prefix terms
+        tables = 'entries e JOIN entries_title_fts ON entries_title_fts.rowid = e.id'
+        conditions.append(TITLE_MATCH_CONDITION)
+        params.append(' '.join(f'"{word}"*' for word in words))
+
+        # A single short prefix matches too many words for its ranking to be of any use
+        if len(words) > 1:
+            order = f'bm25(entries_title_fts, {", ".join(map(str, TITLE_FTS_WEIGHTS))}), e.title, e.id'
+    elif search_key:
+        # The trigram index has no positions, so it finds the entries with every trigram of the key,
+        # which are then checked to contain the key itself
+        conditions.append('e.id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)')
+        conditions.append('instr(e.search_key, ?) > 0')
+        params.append(' '.join(sorted({f'"{search_key[i:i + 3]}"' for i in range(len(search_key) - 2)})))
+        params.append(search_key)
+
+    if platforms:
+        conditions.append(f'e.platform IN ({", ".join("?" * len(platforms))})')
+        params.extend(platforms)
+
+    if regions:
+        conditions.append(
+            f'e.id IN (SELECT entry FROM regions_entries WHERE region IN ({", ".join("?" * len(regions))}))')
+        params.extend(regions)
+
+    return tables, ' AND '.join(conditions) or '1', params, order
+
+
+def get_entry_details(entry_ids):
+    """Retrieve the details of multiple entries, as a dictionary of entry IDs to their regions, links and link summary."""
+    rows = get_connection().execute(f'''
+        SELECT entry, regions, links, link_summary FROM entry_details
+        WHERE entry IN ({", ".join("?" * len(entry_ids))})
+    ''', entry_ids)
+
+    return {
+        entry_id: {
+            'regions': json.loads(regions),
+            'links': json.loads(links),
+            'link_summary': json.loads(link_summary)
+        }
+        for entry_id, regions, links, link_summary in rows
+    }
+
+
+def get_regions(entry_ids):
+    """Retrieve the regions of multiple entries, as a dictionary of entry IDs to region lists."""
+    regions = {entry_id: [] for entry_id in entry_ids}
+    rows = get_connection().execute(f'''
+        SELECT entry, region FROM regions_entries
+        WHERE entry IN ({", ".join("?" * len(entry_ids))})
+        ORDER BY entry, {db_manager.REGIONS_ORDER}
+    ''', entry_ids)
+
+    for entry_id, region in rows:
+        regions[entry_id].append(region)
+    return regions
+
+
+def add_summaries(entries):
+    """Add the regions of multiple entries to them, along with their link summaries if the entry details were computed."""
+    if not entries:
+        return
+
+    if has_entry_details:
+        # A single batched lookup gives the regions and link summaries of all the entries
+        details = get_entry_details([entry['id'] for entry in entries])
+        for entry in entries:
+            entry['regions'] = details[entry['id']]['regions']
+            entry['link_summary'] = details[entry['id']]['link_summary']
+    else:
+        regions_by_entry = get_regions([entry['id'] for entry in entries])
+        for entry in entries:
+            entry['regions'] = regions_by_entry[entry['id']]
+
+
+@cached_per_build
+def search(query='', platforms=(), regions=(), page=1, page_size=DEFAULT_PAGE_SIZE):
+    """Search entries by title, optionally filtered by platforms and regions, one page at a time.
+
+    Entries are ordered by title, or by relevance first when the query has several words.
+
+    Platforms and regions are given as tuples. Returns a dictionary with the entries of the page,
+    each with its regions and its link summary if the entry details were computed, and the total
+    number of matching entries. Results are cached and shared
+    between calls, so they must not be modified.
+    """
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    tables, condition, params, order = build_filters(query, platforms, regions)
+
+    cur = get_connection().cursor()
+    if condition == TITLE_MATCH_CONDITION:
+        # Without other filters, the matches of the word index are counted without reading the entries
+        total = cur.execute(f'SELECT COUNT(*) FROM entries_title_fts WHERE {condition}', params).fetchone()[0]
+    else:
+        total = cur.execute(f'SELECT COUNT(*) FROM {tables} WHERE {condition}', params).fetchone()[0]
+
+    rows = cur.execute(f'''
+        SELECT {", ".join(f"e.{column}" for column in ENTRY_COLUMNS)}
+        FROM {tables}
+        WHERE {condition}
+        ORDER BY {order}
+        LIMIT ? OFFSET ?
+    ''', (*params, page_size, (page - 1) * page_size)).fetchall()
+    cur.close()
+
+    entries = [dict(zip(ENTRY_COLUMNS, row)) for row in rows]
+    add_summaries(entries)
+
+    return {
+        'results': entries,
+        'total': total,
+        'page': page,
+        'page_size': page_size
+    }
+
+
+def get_trigrams(word):
+    """Retrieve the distinct trigrams of a word padded with spaces, as in the similarity index."""
+    padded = f' {word} '
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+def get_word_corrections(cur, word):
+    """Retrieve the title words most similar to a word, as a dictionary of words to their similarity."""
+    trigrams = get_trigrams(word)
+    candidates = cur.execute(f'''
+        SELECT w.word
+        FROM title_word_trigrams t
+        JOIN title_words w ON w.id = t.word
+        WHERE t.trigram IN ({", ".join("?" * len(trigrams))})
+            AND length(w.word) BETWEEN ? AND ?
+        GROUP BY w.id
+        ORDER BY COUNT(*) * 1.0 / (? + length(w.word) - COUNT(*)) DESC, w.entries DESC
+        LIMIT ?
+    ''', (*trigrams, len(word) - MAX_FUZZY_LENGTH_DIFFERENCE, len(word) + MAX_FUZZY_LENGTH_DIFFERENCE,
+          len(trigrams), FUZZY_WORD_CANDIDATES)).fetchall()
+
+    # Shared trigrams only preselect the candidates, as a single typo changes up to three of them.
+    # The cheap upper bounds of the similarity skip most candidates before computing it
+    matcher = SequenceMatcher()
+    matcher.set_seq2(word)
+    scored = []
+    for (candidate,) in candidates:
+        matcher.set_seq1(candidate)
+        if matcher.real_quick_ratio() >= MIN_FUZZY_WORD_SIMILARITY and \
+                matcher.quick_ratio() >= MIN_FUZZY_WORD_SIMILARITY:
+            similarity = matcher.ratio()
+            if similarity >= MIN_FUZZY_WORD_SIMILARITY:
+                scored.append((similarity, candidate))
+
+    scored.sort(key=lambda item: -item[0])
+    return {candidate: similarity for similarity, candidate in scored[:FUZZY_WORD_CORRECTIONS]}
+
+
+def get_fuzzy_candidates(cur, match):
+    """Retrieve the entries matching an expression of the word index, from the most relevant."""
+    rows = cur.execute(f'''
+        SELECT {", ".join(f"e.{column}" for column in ENTRY_COLUMNS)}
+        FROM entries e
+        JOIN entries_title_fts ON entries_title_fts.rowid = e.id
+        WHERE {TITLE_MATCH_CONDITION}
+        ORDER BY bm25(entries_title_fts, {", ".join(map(str, TITLE_FTS_WEIGHTS))})
+        LIMIT ?
+    ''', (match, FUZZY_TITLE_CANDIDATES))
+    return [dict(zip(ENTRY_COLUMNS, row)) for row in rows]
+
+
+@cached_per_build
+def fuzzy_search(query, limit=DEFAULT_FUZZY_LIMIT):
+    """Search the entries with the titles closest to a possibly misspelled query.
+
+    Returns a list of at most `limit` entries, from the most similar, each with its regions, its
+    link summary if the entry details were computed, and its similarity to the query from 0 to 1.
+    Results are cached and shared between calls, so they must not be modified.
+    """
+    limit = min(max(limit, 1), MAX_FUZZY_LIMIT)
+    words = QUERY_WORD_PATTERN.findall(normalize_title(query)[0].lower())
+    cur = get_connection().cursor()
+
+    # Numbers and short words are kept as they are, other words are replaced with their corrections
+    groups = []
+    for word in words:
+        if len(word) < db_manager.MIN_SIMILAR_WORD_LENGTH or word.isdigit():
+            groups.append({word: 1.0})
+        else:
+            corrections = get_word_corrections(cur, word)
+            if corrections:
+                groups.append(corrections)
+
+    if not groups:
+        cur.close()
+        return []
+
+    # Entries matching every word are few and the closest. Only if there are none, entries matching
+    # all the words but one are looked for, as matching any word would rank too many entries.
+    # Words only contain letters and digits, so they are safe to quote as terms
+    alternatives = ['(' + ' OR '.join(f'"{term}"' for term in sorted(group)) + ')' for group in groups]
+    candidates = get_fuzzy_candidates(cur, ' AND '.join(alternatives))
+    if not candidates and len(alternatives) > 1:
+        candidates = get_fuzzy_candidates(cur, ' OR '.join(
+            '(' + ' AND '.join(alternatives[:i] + alternatives[i + 1:]) + ')' for i in range(len(alternatives))))
+    cur.close()
+
+    # The similarity of a title sums the similarity of the closest title word to each word of the query
+    for entry in candidates:
+        title_words = QUERY_WORD_PATTERN.findall(normalize_title(entry['title'])[0].lower())
+        matched = sum(max((group.get(title_word, 0) for title_word in title_words), default=0)
+                      for group in groups)
+        entry['similarity'] = round(min(2 * matched / (len(words) + len(title_words)), 1), 3)
+
+    entries = sorted(candidates, key=lambda entry: (-entry['similarity'], entry['title'], entry['id']))
+    entries = entries[:limit]
+    add_summaries(entries)
+
+    return entries
+
+
+@cached_per_build
+def get_entry(slug):
+    """Retrieve an entry by its slug, with its regions and links, or None if it does not exist.
+
+    Results are cached and shared between calls, so they must not be modified.
+    """
+    cur = get_connection().cursor()
+    row = cur.execute(
+        f'SELECT {", ".join(ENTRY_COLUMNS)} FROM entries WHERE slug = ?', (slug,)).fetchone()
+    if not row:
+        cur.close()
+        return None
+
+    entry = dict(zip(ENTRY_COLUMNS, row))
+    if has_entry_details:
+        cur.close()
+        entry.update(get_entry_details([entry['id']])[entry['id']])
+        return entry
+
+    entry['regions'] = get_regions([entry['id']])[entry['id']]
+    entry['links'] = [dict(zip(LINK_COLUMNS, link)) for link in cur.execute(f'''
+        SELECT {", ".join(LINK_COLUMNS)} FROM links
+        WHERE entry = ?
+        ORDER BY {db_manager.LINKS_ORDER}
+    ''', (entry['id'],))]
+    cur.close()
+
+    return entry
+
+
+def get_facet_counts(platform=db_manager.ANY_FACET_VALUE, region=db_manager.ANY_FACET_VALUE,
+                     host=db_manager.ANY_FACET_VALUE, link_type=db_manager.ANY_FACET_VALUE):
+    """Retrieve the number of entries and links with the given facet values, as an `(entries, links)` tuple."""
+    row = get_connection().execute('''
+        SELECT entries, links FROM facet_counts
+        WHERE platform = ? AND region = ? AND host = ? AND link_type = ?
+    ''', (platform, region, host, link_type)).fetchone()
+    return row or (0, 0)
+
+
+def get_facets(dimension, **values):
+    """Retrieve the values of a facet dimension with their number of entries and links.
+
+    Other dimensions can be given as keyword arguments to count only the entries and links
+    with those values. Returns a list of `(value, entries, links)` tuples. Raises a ValueError
+    for unknown dimensions.
+    """
+    # Dimensions are part of the query, so only known ones are accepted
+    if dimension not in db_manager.FACET_DIMENSIONS:
+        raise ValueError(f"Unknown facet dimension '{dimension}'")
+    for other in values:
+        if other not in db_manager.FACET_DIMENSIONS or other == dimension:
+            raise ValueError(f"Invalid facet filter '{other}'")
+
+    conditions = []
+    params = []
+    for other in db_manager.FACET_DIMENSIONS:
+        if other == dimension:
+            conditions.append(f'{other} != ?')
+            params.append(db_manager.ANY_FACET_VALUE)
+        else:
+            conditions.append(f'{other} = ?')
+            params.append(values.get(other, db_manager.ANY_FACET_VALUE))
+
+    return get_connection().execute(f'''
+        SELECT {dimension}, entries, links FROM facet_counts
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {dimension}
+    ''', params).fetchall()
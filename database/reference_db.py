@@ -0,0 +1,167 @@
+"""
+This module provides functionality for managing the reference database, a SQLite database compiled
+from the downloaded libretro DAT files, GameTDB XML files and MAME hash files. The parsers query it
+lazily instead of parsing the raw files on every run, turning reference lookups into index seeks.
+"""
+import hashlib
+import os
+import sqlite3
+from utils.parse_utils import get_files_version
+
+REFERENCE_DB_NAME = 'data/reference.db'
+REFERENCE_DB_TEMP_NAME = 'data/reference_temp.db'
+
+# Version of the reference database layout, part of the compiled data version
+SCHEMA_VERSION = 1
+
+SCHEMA = [
+    '''
+    CREATE TABLE meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE dat_games (
+        platform TEXT,
+        name TEXT,
+        serial TEXT,
+        search_key TEXT,
+        PRIMARY KEY (platform, name)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE tdb_games (
+        xml TEXT,
+        position INTEGER,
+        id TEXT,
+        name TEXT,
+        type TEXT,
+        region TEXT,
+        platform TEXT,
+        db_region TEXT,
+        search_key TEXT,
+        PRIMARY KEY (xml, position)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE mame_software (
+        list TEXT,
+        name TEXT,
+        description TEXT,
+        search_key TEXT,
+        PRIMARY KEY (list, name)
+    ) WITHOUT ROWID
+    '''
+]
+
+INDEXES = [
+    'CREATE INDEX idx_dat_games_serial ON dat_games (serial);',
+    'CREATE INDEX idx_dat_games_search_key ON dat_games (platform, search_key);',
+    'CREATE INDEX idx_tdb_games_id ON tdb_games (xml, id);',
+    'CREATE INDEX idx_tdb_games_search_key ON tdb_games (xml, search_key);',
+    'CREATE INDEX idx_mame_software_name ON mame_software (name);',
+    'CREATE INDEX idx_mame_software_search_key ON mame_software (search_key);'
+]
+
+# Connection to the reference database, opened on first use
+con = None
+
+
+def get_reference_parsers():
+    """Retrieve the parsers whose reference data is compiled into the reference database."""
+    # Imported here as the parsers themselves query this module
+    from parsers import libretro, gametdb, mame
+    return (libretro, gametdb, mame)
+
+
+def get_files_digest():
+    """Compute the version hash the reference database would have if compiled from the files on disk.
+
+    Returns None if some of the files cannot be read.
+    """
+    digest = hashlib.sha1(f'schema:{SCHEMA_VERSION};'.encode())
+    try:
+        for parser in get_reference_parsers():
+            digest.update(get_files_version(parser.get_reference_files()).encode())
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def get_stored_version():
+    """Retrieve the version hash stored in the reference database, or None if it does not exist."""
+    if not os.path.exists(REFERENCE_DB_NAME):
+        return None
+
+    stored_con = sqlite3.connect(f'file:{REFERENCE_DB_NAME}?mode=ro', uri=True)
+    try:
+        row = stored_con.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.DatabaseError:
+        row = None
+    stored_con.close()
+    return row[0] if row else None
+
+
+def compile_reference_db():
+    """Compile the downloaded reference data files into the reference database."""
+    if os.path.exists(REFERENCE_DB_TEMP_NAME):
+        os.remove(REFERENCE_DB_TEMP_NAME)
+
+    temp_con = sqlite3.connect(REFERENCE_DB_TEMP_NAME)
+    temp_cur = temp_con.cursor()
+    temp_cur.execute('PRAGMA journal_mode = OFF;')
+    temp_cur.execute('PRAGMA synchronous = OFF;')
+
+    for statement in SCHEMA:
+        temp_cur.execute(statement)
+
+    digest = hashlib.sha1(f'schema:{SCHEMA_VERSION};'.encode())
+    for parser in get_reference_parsers():
+        digest.update(parser.compile_reference_data(temp_cur).encode())
+
+    # Indexes are built once all the data is in
+    for statement in INDEXES:
+        temp_cur.execute(statement)
+
+    temp_cur.execute('INSERT INTO meta (key, value) VALUES (?, ?)',
+                     ('version', digest.hexdigest()))
+    temp_con.commit()
+    temp_cur.execute('ANALYZE;')
+    temp_cur.close()
+    temp_con.close()
+
+    os.replace(REFERENCE_DB_TEMP_NAME, REFERENCE_DB_NAME)
+
+
+def get_connection():
+    """Retrieve the read-only connection to the reference database.
+
+    The database is compiled if it does not exist, or if the downloaded data files changed since
+    it was compiled. It is used as it is if the data files cannot be read.
+    """
+    global con
+    if con is not None:
+        return con
+
+    if not os.path.exists(REFERENCE_DB_NAME):
+        print("Reference database not found, compiling it from the downloaded data...")
+        compile_reference_db()
+    else:
+        files_digest = get_files_digest()
+        if files_digest is not None and files_digest != get_stored_version():
+            print("Reference data changed since the reference database was compiled, compiling it again...")
+            compile_reference_db()
+
+    con = sqlite3.connect(f'file:{REFERENCE_DB_NAME}?mode=ro', uri=True)
+    return con
+
+
+def query(sql, params=()):
+    """Run a query on the reference database and return all resulting rows."""
+    return get_connection().execute(sql, params).fetchall()
+
+
+def get_version():
+    """Retrieve the version hash of the compiled reference data."""
+    return query("SELECT value FROM meta WHERE key = 'version'")[0][0]
@@ -0,0 +1,129 @@
+"""
+This module provides functionality for exporting compact binary search indexes of the ROMs database,
+one per platform, so frontends and offline mirrors can search titles without querying the server.
+
+Each index holds the entries of a platform sorted by search key, and is laid out so a browser can
+fetch only what it needs with range requests. All integers are unsigned and little-endian:
+
+- a header of `HEADER_SIZE` bytes: the magic bytes `CSIX`, the format version (u16), the header
+  size (u16), the number of entries N (u32), then the offsets in the file of the key offsets, the
+  keys, the record offsets and the records (u32 each), and the size of the file (u32);
+- N + 1 key offsets (u32), relative to the start of the keys, entry i having the key between
+  offsets i and i + 1;
+- the search keys, in ASCII, as built by `create_search_key`;
+- N + 1 record offsets (u32), relative to the start of the records;
+- the records, in UTF-8, each made of the slug, the title and the comma-separated regions of the
+  entry, separated by NUL characters.
+
+A client fetches the header, then the key offsets and keys, which are contiguous. Entries with keys
+sharing a prefix are contiguous too, so their records are then fetched with a single range request.
+A manifest lists the index file of each platform, named after its content hash so it can be cached
+indefinitely.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+from database.catalogue import write_file
+
+SEARCH_INDEX_DIRNAME = 'search'
+MANIFEST_FILENAME = 'index.json'
+
+# Magic bytes and version of the index format, bumped on any change to the layout
+MAGIC = b'CSIX'
+FORMAT_VERSION = 1
+
+# Layout of the header: magic, version, header size, entry count and section offsets, file size
+HEADER_FORMAT = '<4sHHIIIIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Number of hexadecimal digits of the content hash in index file names
+FILE_HASH_LENGTH = 12
+
+# Query retrieving the entries of a platform with their regions
+ENTRIES_QUERY = '''
+    SELECT
+        e.search_key,
+        e.slug,
+        e.title,
+        (
+            SELECT group_concat(region, ',') FROM (
+                SELECT region FROM regions_entries WHERE entry = e.id ORDER BY region
+            )
+        )
+    FROM entries e
+    WHERE e.platform = ?
+'''
+
+
+def pack_strings(strings):
+    """Pack encoded strings one after the other, returning their N + 1 offsets and their data."""
+    offsets = [0]
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+    return struct.pack(f'<{len(offsets)}I', *offsets), b''.join(strings)
+
+
+def build_search_index(rows):
+    """Build the binary search index of entries given as `(search_key, slug, title, regions)` rows."""
+    # Keys are ASCII, so sorting them as strings gives the byte order clients compare them in
+    rows = sorted(rows, key=lambda row: (row[0] or '', row[1]))
+
+    key_offsets, keys = pack_strings([(row[0] or '').encode('ascii') for row in rows])
+    record_offsets, records = pack_strings(
+        ['\0'.join((slug, title, regions or '')).encode('utf-8') for _, slug, title, regions in rows])
+
+    key_offsets_offset = HEADER_SIZE
+    keys_offset = key_offsets_offset + len(key_offsets)
+    record_offsets_offset = keys_offset + len(keys)
+    records_offset = record_offsets_offset + len(record_offsets)
+    size = records_offset + len(records)
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, HEADER_SIZE, len(rows), key_offsets_offset,
+                         keys_offset, record_offsets_offset, records_offset, size)
+    return header + key_offsets + keys + record_offsets + records
+
+
+def export_search_indexes(db_path, index_dir):
+    """Export the binary search index of each platform, along with their manifest.
+
+    Index files of previous exports are removed. Returns the number of indexes and their total size.
+    """
+    con = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    cur = con.cursor()
+
+    manifest = {'format_version': FORMAT_VERSION, 'platforms': {}}
+    size = 0
+    platforms = [row[0] for row in
+                 cur.execute('SELECT DISTINCT platform FROM entries ORDER BY platform').fetchall()]
+
+    for platform in platforms:
+        rows = cur.execute(ENTRIES_QUERY, (platform,)).fetchall()
+        content = build_search_index(rows)
+        content_hash = hashlib.sha256(content).hexdigest()
+        filename = f'{platform}.{content_hash[:FILE_HASH_LENGTH]}.bin'
+
+        write_file(os.path.join(index_dir, filename), content)
+        manifest['platforms'][platform] = {
+            'file': filename,
+            'hash': content_hash,
+            'entries': len(rows),
+            'size': len(content)
+        }
+        size += len(content)
+
+    cur.close()
+    con.close()
+
+    # Remove the index files that are not listed in the manifest anymore
+    filenames = {platform_index['file'] for platform_index in manifest['platforms'].values()}
+    for filename in os.listdir(index_dir) if os.path.exists(index_dir) else []:
+        if filename.endswith('.bin') and filename not in filenames:
+            os.remove(os.path.join(index_dir, filename))
+
+    # The manifest is written last, so it never lists indexes that are not written yet
+    write_file(os.path.join(index_dir, MANIFEST_FILENAME),
+               json.dumps(manifest, indent=4, sort_keys=True).encode('utf-8'))
+
+    return len(platforms), size
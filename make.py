@@ -1,17 +1,24 @@
 #!/usr/bin/env python
 """
 This script is responsible for initializing a database, processing sources for scraping and parsing,
-and moving generated static files to a specified directory. It integrates various scrapers and parsers
+and syncing generated static files to a specified directory. It integrates various scrapers and parsers
 to handle data from multiple platforms and formats.
 """
+import argparse
+import hashlib
 import json
+import re
 import sys
 import os
 import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from parsers import no_intro
 from scrapers import myrient, internet_archive, nopaystation, mariocube
 from parsers import libretro, gametdb, mame, wii_rom_set_by_ghostware
-from database import db_manager
+from database import db_manager, reference_db, delta, catalogue, search_index, builds
+from utils import parser_chain
 
 SCRAPERS = {
     'myrient': myrient,
@@ -29,6 +36,27 @@ PARSERS = {
 }
 
 
+# Minimum number of entries in a chunk parsed by a parse worker
+MIN_PARSE_CHUNK_SIZE = 256
+
+# Number of chunks given to each parse worker for a source, to balance uneven chunks
+PARSE_CHUNKS_PER_WORKER = 4
+
+# File with the number of entries of each platform in the last full build, used to balance shards
+SOURCE_SIZES_FILENAME = 'source_sizes.json'
+
+# Manifest written in the shards directory by each shard of a build split over multiple machines,
+# listing the platforms it built and the hash of the weights they were split with
+SHARD_MANIFEST_FILENAME_FORMAT = 'shard_{index}_of_{count}.json'
+SHARD_MANIFEST_PATTERN = re.compile(r'shard_(\d+)_of_(\d+)\.json')
+
+# File in the static files directory of a build listing the hash and size of each synced file
+STATIC_MANIFEST_FILENAME = '.static_manifest.json'
+
+# Size of the chunks static files are read in to compute their hash
+STATIC_HASH_CHUNK_SIZE = 1024 * 1024
+
+
 def load_sources(file_path='sources.json'):
     """Load sources from a JSON file."""
     with open(file_path, 'r') as file:
@@ -51,7 +79,40 @@ def get_parser(name):
     return PARSERS.get(name)
 
 
-def process_sources(sources, use_cached):
+def init_parse_worker(workers=1):
+    """Open the reference database once when a parse worker starts, and share the box art probes between workers."""
+    reference_db.get_connection()
+    gametdb.share_executors(workers)
+
+
+def parse_chunk(parser_specs, entries, use_memo=False):
+    """Run a chain of parsers, given as `(name, flags)` pairs, over a chunk of entries."""
+    parsers = [(get_parser(parser_name), parser_flags)
+               for parser_name, parser_flags in parser_specs]
+    return parser_chain.run_chain(parsers, entries, use_memo)
+
+
+def parse_entries(parser_specs, entries, use_memo=False, parse_executor=None, parse_workers=1):
+    """Parse entries, sharding them into chunks across the parse workers if available.
+
+    Chunks are reassembled in their original order, so the result does not depend on the number of workers.
+    """
+    chunk_size = max(MIN_PARSE_CHUNK_SIZE, -(-len(entries) //
+                     (parse_workers * PARSE_CHUNKS_PER_WORKER)))
+
+    if not parse_executor or len(entries) <= chunk_size:
+        return parse_chunk(parser_specs, entries, use_memo)
+
+    chunks = [entries[i:i + chunk_size]
+              for i in range(0, len(entries), chunk_size)]
+
+    parsed_entries = []
+    for parsed_chunk in parse_executor.map(parse_chunk, repeat(parser_specs), chunks, repeat(use_memo)):
+        parsed_entries.extend(parsed_chunk)
+    return parsed_entries
+
+
+def process_sources(sources, use_cached, use_memo=False, parse_executor=None, parse_workers=1):
     """Process the sources to scrape, parse, and insert data into the database."""
     for platform, source_list in sources.items():
         print(f"\n{platform}:")
@@ -70,63 +131,440 @@ def process_sources(sources, use_cached):
 
             entries = scraper.scrape(source, platform, use_cached)
 
-            for parser_name, parser_flags in source['parsers'].items():
-                parser = get_parser(parser_name)
-                if not parser:
+            for parser_name in source['parsers']:
+                if not get_parser(parser_name):
                     print(f"Parser '{parser_name}' not found.")
                     sys.exit(1)
 
-                entries = parser.parse(entries, parser_flags)
+            entries = parse_entries(list(source['parsers'].items()), entries,
+                                    use_memo, parse_executor, parse_workers)
 
-            for entry in entries:
-                db_manager.insert_entry(entry)
+            db_manager.insert_entries(entries)
 
 
-def move_static_files(destination_dir, static_dir='static'):
-    """Move the contents of the static directory to the destination directory, overwriting if necessary."""
-    if not os.path.exists(static_dir):
-        return
+def build_shard(platform, source_list, use_cached, use_memo=False):
+    """Process the sources of a platform into its own shard database."""
+    db_manager.init_database(db_manager.get_shard_path(platform))
+    process_sources({platform: source_list}, use_cached, use_memo)
+    parser_chain.close_memo()
+    db_manager.close_shard()
+
+
+def process_sources_sharded(sources, use_cached, use_memo=False, shard_workers=1, merge=True):
+    """Process the sources of each platform into a shard database in parallel, merging them in order.
+
+    Shards are merged in the order of the platforms as soon as they are ready, so the result
+    is the same as processing the sources sequentially. Without merging, the shards are kept
+    in the shards directory.
+    """
+    os.makedirs(db_manager.SHARDS_DIR, exist_ok=True)
+
+    # Make sure the reference database exists before the workers start reading it
+    reference_db.get_connection()
+
+    # Workers are spawned so they never inherit open database connections
+    with ProcessPoolExecutor(max_workers=shard_workers, initializer=init_parse_worker, initargs=(shard_workers,),
+                             mp_context=multiprocessing.get_context('spawn')) as shard_executor:
+        futures = {platform: shard_executor.submit(build_shard, platform, source_list, use_cached, use_memo)
+                   for platform, source_list in sources.items()}
+
+        for platform, future in futures.items():
+            future.result()
+            if merge:
+                shard_path = db_manager.get_shard_path(platform)
+                db_manager.merge_shard(shard_path)
+                os.remove(shard_path)
+
+
+def load_source_sizes(file_path=SOURCE_SIZES_FILENAME):
+    """Load the number of entries of each platform in the last full build."""
+    if not os.path.exists(file_path):
+        return {}
+
+    with open(file_path, 'r') as file:
+        return json.load(file)
+
+
+def save_source_sizes(sizes, file_path=SOURCE_SIZES_FILENAME):
+    """Save the number of entries of each platform."""
+    with open(file_path, 'w') as file:
+        json.dump(sizes, file, indent=4, sort_keys=True)
+
+
+def get_shard_weights(sources, sizes):
+    """Compute the weight of each platform when splitting a build, from the number of entries of each platform.
+
+    Platforms without a recorded size weigh the average size of the others.
+    """
+    known_sizes = [sizes[platform] for platform in sources if platform in sizes]
+    default_size = sum(known_sizes) / len(known_sizes) if known_sizes else 1
+
+    return {platform: sizes.get(platform, default_size) for platform in sources}
+
+
+def get_weights_hash(weights):
+    """Compute a hash of the platform weights a build was split with."""
+    return hashlib.sha256(json.dumps(weights, sort_keys=True).encode()).hexdigest()
+
+
+def get_shard_platforms(sources, shard_index, shard_count, weights):
+    """Retrieve the platforms processed by a shard of a build split over multiple machines.
+
+    Platforms are assigned with the longest processing time first rule, weighted by their number
+    of entries in the last full build, so every machine computes the same split from the same weights.
+    """
+    platform_order = {platform: i for i, platform in enumerate(sources)}
 
-    if not os.path.exists(destination_dir):
-        os.makedirs(destination_dir)
+    loads = [0] * shard_count
+    assignments = [[] for _ in range(shard_count)]
+    for platform in sorted(sources, key=lambda platform: (-weights[platform], platform_order[platform])):
+        # Assign to the least loaded shard, the first one on ties
+        shard = loads.index(min(loads))
+        loads[shard] += weights[platform]
+        assignments[shard].append(platform)
 
+    return [platform for platform in sources if platform in assignments[shard_index]]
+
+
+def parse_shard(value):
+    """Parse a shard argument in the `i/n` form into a zero-based shard index and a shard count."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected 'i/n'")
+
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            f"invalid shard '{value}', expected 1 <= i <= n")
+    return index - 1, count
+
+
+def make_shard(shard, sizes_path, use_cached=False, use_memo=True, shard_workers=1):
+    """Process the platforms of a shard of a build split over multiple machines into shard databases.
+
+    The platforms are split by the sizes in the given file, which must be the same on every machine.
+    A manifest listing the platforms built is written once their shard databases are complete.
+    """
+    shard_index, shard_count = shard
+    sources = load_sources()
+
+    if not os.path.exists(sizes_path):
+        print(f"Sizes file '{sizes_path}' not found.")
+        sys.exit(1)
+
+    weights = get_shard_weights(sources, load_source_sizes(sizes_path))
+    platforms = get_shard_platforms(sources, shard_index, shard_count, weights)
+    print(f"Shard {shard_index + 1}/{shard_count}: {', '.join(platforms)}")
+
+    process_sources_sharded({platform: sources[platform] for platform in platforms},
+                            use_cached, use_memo, shard_workers, merge=False)
+
+    manifest = {
+        'shard': shard_index + 1,
+        'shards': shard_count,
+        'weights_hash': get_weights_hash(weights),
+        'platforms': platforms
+    }
+    manifest_path = os.path.join(db_manager.SHARDS_DIR, SHARD_MANIFEST_FILENAME_FORMAT.format(
+        index=shard_index + 1, count=shard_count))
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=4)
+    print(f"Shard databases created in '{db_manager.SHARDS_DIR}'.")
+
+
+def load_shard_manifests():
+    """Load the manifests of the shards gathered in the shards directory."""
+    manifests = []
+    if os.path.exists(db_manager.SHARDS_DIR):
+        for filename in sorted(os.listdir(db_manager.SHARDS_DIR)):
+            if SHARD_MANIFEST_PATTERN.fullmatch(filename):
+                with open(os.path.join(db_manager.SHARDS_DIR, filename), 'r') as file:
+                    manifests.append(json.load(file))
+    return manifests
+
+
+def check_shards(sources):
+    """Check that the gathered shards split the platforms the same way and cover each of them exactly once.
+
+    Exits with an error describing the first problem found.
+    """
+    manifests = load_shard_manifests()
+    if not manifests:
+        print(f"No shard manifests found in '{db_manager.SHARDS_DIR}', "
+              "copy the shards directory of every machine here before merging.")
+        sys.exit(1)
+
+    # All the shards must come from the same split, computed from the same weights
+    splits = {(manifest['shards'], manifest['weights_hash']) for manifest in manifests}
+    if len(splits) > 1:
+        print("Shards were split differently (different shard counts or sizes files), "
+              "build every shard again with the same --shard count and --sizes file.")
+        sys.exit(1)
+
+    shard_count = manifests[0]['shards']
+    missing_shards = sorted(set(range(1, shard_count + 1)) - {manifest['shard'] for manifest in manifests})
+    if missing_shards:
+        print(f"Shards {', '.join(f'{index}/{shard_count}' for index in missing_shards)} not found, "
+              f"copy the shards directory of the machines that built them here.")
+        sys.exit(1)
+
+    shard_by_platform = {}
+    for manifest in manifests:
+        for platform in manifest['platforms']:
+            if platform in shard_by_platform:
+                print(f"Platform '{platform}' was built by more than one shard.")
+                sys.exit(1)
+            shard_by_platform[platform] = manifest['shard']
+
+    for platform in sources:
+        if platform not in shard_by_platform:
+            print(f"Platform '{platform}' was not built by any shard.")
+            sys.exit(1)
+        if not os.path.exists(db_manager.get_shard_path(platform)):
+            print(f"Shard database for '{platform}' not found, copy it from the machine that built "
+                  f"shard {shard_by_platform[platform]}/{shard_count}.")
+            sys.exit(1)
+
+    unknown_platforms = sorted(set(shard_by_platform) - set(sources))
+    if unknown_platforms:
+        print(f"Shards built platforms that are not in the sources: {', '.join(unknown_platforms)}.")
+        sys.exit(1)
+
+
+def merge_shards():
+    """Merge the shard databases of all platforms, built on any number of machines, into the final database."""
+    config = load_config()
+    sources = load_sources()
+    check_shards(sources)
+
+    db_manager.init_database()
+
+    # Merging in the order of the platforms gives the same database as a single machine build
+    for platform in sources:
+        db_manager.merge_shard(db_manager.get_shard_path(platform))
+
+    finalize(config)
+
+
+def get_file_hash(path):
+    """Compute the SHA-256 hash of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(STATIC_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_files(directory):
+    """List the files of a directory recursively, as sorted paths relative to it with forward slashes."""
+    paths = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(root, filename), directory)
+            paths.append(path.replace(os.sep, '/'))
+    return sorted(paths)
+
+
+def load_static_manifest(destination_dir, static_dir='static'):
+    """Load the manifest of the last static files sync, mapping each file to its hash and size.
+
+    Without a manifest, the files of the destination directory found under the items of the static
+    directory are hashed, as if they were synced before.
+    """
+    manifest_path = os.path.join(destination_dir, STATIC_MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+
+    manifest = {}
     for item in os.listdir(static_dir):
-        source_path = os.path.join(static_dir, item)
         destination_path = os.path.join(destination_dir, item)
+        if os.path.isdir(destination_path):
+            paths = [f'{item}/{path}' for path in list_files(destination_path)]
+        elif os.path.isfile(destination_path):
+            paths = [item]
+        else:
+            continue
+
+        for path in paths:
+            file_path = os.path.join(destination_dir, path)
+            manifest[path] = {'hash': get_file_hash(file_path), 'size': os.path.getsize(file_path)}
+
+    return manifest
+
 
-        if os.path.exists(destination_path):
-            # Remove existing file or directory
-            if os.path.isdir(destination_path):
-                shutil.rmtree(destination_path)
-            else:
-                os.remove(destination_path)
+def remove_empty_dirs(path, root_dir):
+    """Remove the directory of a path and its parents while they are empty, up to the root directory."""
+    directory = os.path.dirname(path)
+    while os.path.abspath(directory) != os.path.abspath(root_dir) and \
+            os.path.isdir(directory) and not os.listdir(directory):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
 
-        # Move the source to the destination
-        shutil.move(source_path, destination_dir)
 
+def sync_static_files(destination_dir, static_dir='static'):
+    """Sync the contents of the static directory to the destination directory, then empty it.
 
-def make(use_cached=False):
+    Only new and changed files are moved, each atomically replacing the previous one, and files
+    left over from the last sync are removed. Unchanged files are not touched, as they may be hard
+    linked with other builds. Returns the number of files written, unchanged and removed.
+    """
+    if not os.path.exists(static_dir):
+        return 0, 0, 0
+
+    os.makedirs(destination_dir, exist_ok=True)
+
+    old_manifest = load_static_manifest(destination_dir, static_dir)
+    manifest = {}
+    written = 0
+    unchanged = 0
+
+    for path in list_files(static_dir):
+        source_path = os.path.join(static_dir, path)
+        destination_path = os.path.join(destination_dir, path)
+        manifest[path] = {'hash': get_file_hash(source_path), 'size': os.path.getsize(source_path)}
+
+        # Skip files with the same content as in the last sync
+        if old_manifest.get(path) == manifest[path] and os.path.isfile(destination_path) and \
+                os.path.getsize(destination_path) == manifest[path]['size']:
+            unchanged += 1
+            continue
+
+        # Files are replaced rather than overwritten, so builds sharing them are left untouched
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        temp_path = f'{destination_path}.tmp'
+        shutil.move(source_path, temp_path)
+        os.replace(temp_path, destination_path)
+        written += 1
+
+    # Remove the files that are not part of the static files anymore
+    removed = 0
+    for path in old_manifest:
+        if path in manifest:
+            continue
+
+        destination_path = os.path.join(destination_dir, path)
+        if os.path.isfile(destination_path):
+            os.remove(destination_path)
+            remove_empty_dirs(destination_path, destination_dir)
+        removed += 1
+
+    # The manifest is written last, so it never lists files that are not synced yet
+    catalogue.write_file(os.path.join(destination_dir, STATIC_MANIFEST_FILENAME),
+                         json.dumps(manifest, indent=4, sort_keys=True).encode('utf-8'))
+
+    # Files left in the static directory are the unchanged ones, generated again by the next build
+    for item in os.listdir(static_dir):
+        item_path = os.path.join(static_dir, item)
+        if os.path.isdir(item_path):
+            shutil.rmtree(item_path)
+        else:
+            os.remove(item_path)
+
+    return written, unchanged, removed
+
+
+def make(use_cached=False, parse_workers=1, use_memo=True, shard_workers=1):
     """Main function to initialize the database, process sources, and close the database."""
     config = load_config()
     sources = load_sources()
     db_manager.init_database()
 
-    process_sources(sources, use_cached)
+    if shard_workers > 1:
+        # Each shard worker parses its own entries, parse workers are not used
+        process_sources_sharded(sources, use_cached, use_memo, shard_workers)
+    elif parse_workers > 1:
+        # Make sure the reference database exists before the workers start reading it
+        reference_db.get_connection()
 
-    db_manager.close_database()
-    print("Database created successfully.")
+        # Workers are spawned so they never inherit open database connections
+        with ProcessPoolExecutor(max_workers=parse_workers, initializer=init_parse_worker, initargs=(parse_workers,),
+                                 mp_context=multiprocessing.get_context('spawn')) as parse_executor:
+            process_sources(sources, use_cached, use_memo,
+                            parse_executor, parse_workers)
+    else:
+        process_sources(sources, use_cached, use_memo)
+
+    parser_chain.close_memo()
+
+    finalize(config)
+
+
+def finalize(config):
+    """Close the database into a new build, record the size of each platform, export the files of the build and publish it."""
+    save_source_sizes(db_manager.get_platform_sizes())
 
     static_files_dir_path = config.get('static_files_dir_path')
-    if static_files_dir_path:
-        move_static_files(static_files_dir_path)
-        print(f"Static files moved to '{static_files_dir_path}'.")
+    build_id = builds.create_build()
+    build_dir = builds.get_build_dir(build_id)
+    db_path = os.path.join(build_dir, db_manager.DB_NAME)
+
+    db_manager.close_database(config.get('entry_details', True), db_path)
+    print(f"Database created successfully in '{db_path}'.")
+    print(f"Skipped {db_manager.duplicate_links} duplicate links.")
+
+    # Deltas can only be created from the published build, if it has the same schema
+    if os.path.exists(db_manager.DB_NAME) and \
+            delta.get_schema_version(db_manager.DB_NAME) == db_manager.SCHEMA_VERSION:
+        delta_path = os.path.join(build_dir, delta.DELTA_NAME)
+        changes = delta.create_delta(db_manager.DB_NAME, db_path, delta_path)
+        print(f"Delta with {changes} changes from the previous build created in '{delta_path}'.")
+
+    # Search indexes are written into the static directory, to be deployed with the other static files
+    index_dir = os.path.join('static', search_index.SEARCH_INDEX_DIRNAME)
+    indexes, size = search_index.export_search_indexes(db_path, index_dir)
+    print(f"Search indexes of {indexes} platforms exported to '{index_dir}' ({size} bytes).")
+
+    # The static files of the build start from those of the published build
+    static_dir = builds.prepare_static_dir(build_id, static_files_dir_path)
+    written, unchanged, removed = sync_static_files(static_dir)
+    print(f"Static files synced to '{static_dir}': {written} files written, "
+          f"{unchanged} unchanged, {removed} removed.")
+
+    # The catalogue is exported in place, so unchanged shards are kept as they are
+    catalogue_dir = os.path.join(static_dir, catalogue.CATALOGUE_DIRNAME)
+    written, unchanged, removed = catalogue.export_catalogue(db_path, catalogue_dir)
+    print(f"Catalogue exported to '{catalogue_dir}': {written} shards written, "
+          f"{unchanged} unchanged, {removed} removed.")
+
+    builds.publish_build(build_id, static_files_dir_path)
+    print(f"Build '{build_id}' published.")
+
+    removed_builds = builds.prune_builds(config.get('kept_builds', builds.DEFAULT_KEPT_BUILDS))
+    if removed_builds:
+        print(f"Removed {len(removed_builds)} old builds.")
 
 
 if __name__ == '__main__':
     # Change directory to script location
     os.chdir(os.path.dirname(os.path.realpath(__file__)))
 
-    args = sys.argv[1:] if len(sys.argv) > 1 else []
-    use_cached = '--use-cached' in args
-
-    make(use_cached)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--use-cached', action='store_true',
+                        help="use cached responses from sources URLs")
+    parser.add_argument('--parse-workers', type=int, default=1, metavar='N',
+                        help="number of worker processes used for parsing entries")
+    parser.add_argument('--no-parser-memo', action='store_true',
+                        help="parse all entries again instead of reusing results from previous runs")
+    parser.add_argument('--shard-workers', type=int, default=1, metavar='N',
+                        help="number of worker processes writing the platforms into shard databases")
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help="only process the I-th of N balanced subsets of the platforms into shard databases")
+    parser.add_argument('--sizes', metavar='FILE',
+                        help="file with the number of entries of each platform the shards are balanced by, "
+                             "the same on every machine (required with --shard)")
+    parser.add_argument('--merge-shards', action='store_true',
+                        help="merge the shard databases of all platforms into the final database")
+    args = parser.parse_args()
+
+    if args.shard and not args.sizes:
+        parser.error("--shard requires --sizes")
+
+    if args.merge_shards:
+        merge_shards()
+    elif args.shard:
+        make_shard(args.shard, args.sizes, args.use_cached,
+                   not args.no_parser_memo, args.shard_workers)
+    else:
+        make(args.use_cached, args.parse_workers,
+             not args.no_parser_memo, args.shard_workers)
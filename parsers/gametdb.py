@@ -4,17 +4,60 @@ retrieving box art URLs, and enriching game entries with additional metadata.
 It includes utilities for caching box art URLs, mapping game types and regions 
 to platforms, and validating box art URLs.
 """
+import os
 import re
 import json
+import threading
 import requests
-import xml.etree.ElementTree as ET
-from utils.parse_utils import create_search_key
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.kv_cache import KeyValueCache
+from database import reference_db
+from utils.parse_utils import create_search_key, iter_xml_elements, get_files_version
 
 # Global cache for box art URLs
 boxart_urls_cache = None
 
 CACHE_DIRNAME = 'cache'
-BOXART_URLS_CACHE_FILENAME = 'boxart_urls.json'
+BOXART_URLS_CACHE_FILENAME = 'boxart_urls.db'
+
+# Legacy JSON cache, imported once into the database cache if present
+LEGACY_BOXART_URLS_CACHE_FILENAME = 'boxart_urls.json'
+
+# Time after which a missing box art is probed again (in seconds)
+MISSING_BOXART_TTL = 30 * 24 * 60 * 60
+
+# Cache key under which the country hit counts are stored
+COUNTRY_HITS_CACHE_KEY = 'country_hits'
+
+# Learned box art hit counts per country, keyed by platform and region code
+country_hits = None
+
+# Hits recorded since the counts were last saved, added to the stored counts on save in a single
+# write transaction, so that concurrent parse workers do not overwrite each other's counts
+new_country_hits = {}
+
+# Maximum number of box art HEAD requests in flight at once, across all processes
+BOXART_PROBE_WORKERS = 32
+
+# Maximum number of game IDs having their box art resolved at once, across all processes
+BOXART_RESOLVE_WORKERS = 8
+
+# Share of the box art thread pools given to this process, set by `share_executors`
+probe_workers = BOXART_PROBE_WORKERS
+resolve_workers = BOXART_RESOLVE_WORKERS
+
+# Number of countries raced concurrently for a single game ID
+BOXART_PROBE_RACE_WIDTH = 4
+
+# Thread pools used for box art probing, created on first use
+probe_executor = None
+resolve_executor = None
+
+# Per-thread storage for HTTP sessions
+thread_local = threading.local()
+
+# Box art requests queued while parsing entries, resolved together once all entries are parsed
+boxart_requests = []
 
 # List of XML filenames containing game data
 XML_FILENAMES = [
@@ -228,119 +271,322 @@ BOXART_URL_PLATFORM_PATHS_MAP = {
 # Base URL for GameTDB artwork
 GAMETDB_ARTWORK_BASE_URL = 'https://art.gametdb.com'
 
-# Global variable to store parsed TDB data
-tdbs = None
+# Pattern matching the part of a title from its first parenthesis onwards
+TITLE_EXTRA_INFO_PATTERN = re.compile(r"\(.*")
+
+
+def get_compare_value(title):
+    """Get a simple to compare value from a title, ignoring extra info in parentheses."""
+    return create_search_key(TITLE_EXTRA_INFO_PATTERN.sub('', title))
+
+
+def iter_tdb_games(xml_filename):
+    """Iterate over the games of a TDB XML file."""
+    for game in iter_xml_elements(f'data/gametdb/{xml_filename}', 'game'):
+        yield {
+            'name': game.get('name'),
+            'id': game.findtext('id'),
+            'type': game.findtext('type'),
+            'region': game.findtext('region')
+        }
 
 
-def load_tdbs():
-    """Load TDB data from XML files into memory."""
-    global tdbs
-    tdbs = {}
+def get_reference_files():
+    """Retrieve the paths of the TDB XML files compiled into the reference database."""
+    return [f'data/gametdb/{xml_filename}' for xml_filename in XML_FILENAMES]
 
+
+def compile_reference_data(cur):
+    """Insert the games of the TDB XML files into the reference database.
+
+    Returns a version hash of the TDB XML files.
+    """
     for xml_filename in XML_FILENAMES:
-        tree = ET.parse(f'data/gametdb/{xml_filename}')
-        root = tree.getroot()
+        # Platform and region are stored already mapped, NULL when the type has no platform
+        cur.executemany('''
+            INSERT INTO tdb_games (xml, position, id, name, type, region, platform, db_region, search_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', ((xml_filename, position, game['id'], game['name'], game['type'], game['region'],
+               TYPE_PLATFORM_MAP[xml_filename].get(game['type']),
+               REGION_REGION_MAP.get(game['region']),
+               get_compare_value(game['name']))
+              for position, game in enumerate(iter_tdb_games(xml_filename))))
+
+    return get_files_version(get_reference_files())
 
-        tdbs[xml_filename] = []
 
-        for game in root.findall('game'):
-            tdbs[xml_filename].append(
-                {
-                    'name': game.get('name'),
-                    'id': game.find('id').text,
-                    'type': game.find('type').text,
-                    'region': game.find('region').text
-                }
-            )
+def get_reference_version():
+    """Retrieve the version hash of the reference data."""
+    return reference_db.get_version()
 
 
 def load_boxart_cache():
-    """Load the boxart URL cache from a JSON file."""
+    """Open the boxart URL cache database, importing the legacy JSON cache if needed."""
     global boxart_urls_cache
-    if boxart_urls_cache is None:
+    if boxart_urls_cache is not None:
+        return
+
+    boxart_urls_cache = KeyValueCache(
+        f'{CACHE_DIRNAME}/{BOXART_URLS_CACHE_FILENAME}', none_ttl=MISSING_BOXART_TTL)
+
+    legacy_path = f'{CACHE_DIRNAME}/{LEGACY_BOXART_URLS_CACHE_FILENAME}'
+    if boxart_urls_cache.is_empty() and os.path.exists(legacy_path):
         try:
-            with open(f'{CACHE_DIRNAME}/{BOXART_URLS_CACHE_FILENAME}', 'r') as f:
-                boxart_urls_cache = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            boxart_urls_cache = {}
+            with open(legacy_path, 'r') as f:
+                legacy_cache = json.load(f)
+        except json.JSONDecodeError:
+            legacy_cache = {}
+
+        for platform, urls in legacy_cache.items():
+            for id, url in urls.items():
+                boxart_urls_cache.set(f'{platform}/{id}', url)
+        boxart_urls_cache.flush()
 
 
 def save_boxart_cache():
-    """Save the boxart URL cache to a JSON file."""
-    with open(f'{CACHE_DIRNAME}/{BOXART_URLS_CACHE_FILENAME}', 'w') as f:
-        json.dump(boxart_urls_cache, f)
+    """Write pending boxart URL cache changes to disk."""
+    if boxart_urls_cache is None:
+        return
+
+    if new_country_hits:
+        boxart_urls_cache.modify(COUNTRY_HITS_CACHE_KEY, add_country_hits, {})
+        new_country_hits.clear()
+    boxart_urls_cache.flush()
+
+
+def add_country_hits(stored_hits):
+    """Add the hits recorded since the last save to the stored country hit counts."""
+    for key, hits in new_country_hits.items():
+        stored = stored_hits.setdefault(key, {})
+        for country, count in hits.items():
+            stored[country] = stored.get(country, 0) + count
+    return stored_hits
 
 
 def cache_boxart_url(platform, id, url):
     """Cache a boxart URL for a specific platform and game ID."""
     load_boxart_cache()
-
-    if platform not in boxart_urls_cache:
-        boxart_urls_cache[platform] = {}
-
-    boxart_urls_cache[platform][id] = url
-    save_boxart_cache()
+    boxart_urls_cache.set(f'{platform}/{id}', url)
 
 
 def get_cached_boxart_url(platform, id):
     """Retrieve a cached boxart URL for a specific platform and game ID."""
     load_boxart_cache()
+    return boxart_urls_cache.get(f'{platform}/{id}', False)
+
+
+def load_country_hits():
+    """Load the learned country hit counts from the boxart cache."""
+    global country_hits
+    if country_hits is None:
+        load_boxart_cache()
+        country_hits = boxart_urls_cache.get(COUNTRY_HITS_CACHE_KEY, {})
+
+
+def record_country_hit(platform, region_code, country):
+    """Count a box art found for a country, platform and region code."""
+    load_country_hits()
+    for counts in (country_hits, new_country_hits):
+        hits = counts.setdefault(f'{platform}/{region_code}', {})
+        hits[country] = hits.get(country, 0) + 1
+
+
+def get_country_hits_snapshot():
+    """Copy the learned country hit counts, to order the probes of a batch of game IDs."""
+    load_country_hits()
+    return {key: dict(hits) for key, hits in country_hits.items()}
+
+
+def get_country_order(platform, region_code, country, hits_snapshot):
+    """Get the countries to probe for a game ID, the most likely ones first according to a snapshot of the hit counts."""
+    countries = [country] + \
+        [other for other in GAMETDB_COUNTRIES if other != country]
+
+    # Sorting is stable, so countries without hits keep the default priority
+    hits = hits_snapshot.get(f'{platform}/{region_code}', {})
+    return sorted(countries, key=lambda other: -hits.get(other, 0))
+
+
+def share_executors(processes):
+    """Size the box art thread pools of this process for the given number of processes probing at once."""
+    global probe_workers, resolve_workers
+    probe_workers = max(1, BOXART_PROBE_WORKERS // processes)
+    resolve_workers = max(1, BOXART_RESOLVE_WORKERS // processes)
 
-    if platform not in boxart_urls_cache:
-        return False
 
-    return boxart_urls_cache[platform].get(id, False)
+def get_executors():
+    """Retrieve the thread pools used for box art probing, creating them if needed."""
+    global probe_executor, resolve_executor
+    if probe_executor is None:
+        probe_executor = ThreadPoolExecutor(max_workers=probe_workers)
+        resolve_executor = ThreadPoolExecutor(
+            max_workers=resolve_workers)
+    return probe_executor, resolve_executor
+
+
+def get_session():
+    """Retrieve the HTTP session of the current thread."""
+    if not hasattr(thread_local, 'session'):
+        thread_local.session = requests.Session()
+    return thread_local.session
 
 
 def fetch_boxart_url(url):
     """Check if a boxart URL is valid by sending a HEAD request."""
     try:
-        response = requests.head(url, allow_redirects=True, timeout=5)
-        if response.status_code == 200:
-            return True
+        response = get_session().head(url, allow_redirects=True, timeout=5)
+        return response.status_code == 200
     except requests.RequestException:
         return False
 
 
-def build_boxart_url(platform, country, id):
-    """Build and validate a boxart URL for a specific platform, country, and game ID."""
-    boxart_url = get_cached_boxart_url(platform, id)
-    if boxart_url != False:
-        return boxart_url
-
+def probe_boxart_url(platform, country, id, region_code, hits_snapshot):
+    """Find the box art URL of a game ID by racing the candidate countries in priority order."""
     file_extension = 'jpg' if platform in (
         '3ds', 'n3ds', 'wiiu', 'ps3') else 'png'
 
     base_path = BOXART_URL_PLATFORM_PATHS_MAP[platform]
 
-    # First try with user-given country
-    boxart_url = f'{GAMETDB_ARTWORK_BASE_URL}/{base_path}/{country}/{id}.{file_extension}'
-    if fetch_boxart_url(boxart_url):
+    probe_executor, _ = get_executors()
+    countries = get_country_order(platform, region_code, country, hits_snapshot)
+
+    for i in range(0, len(countries), BOXART_PROBE_RACE_WIDTH):
+        candidates = [
+            (candidate, f'{GAMETDB_ARTWORK_BASE_URL}/{base_path}/{candidate}/{id}.{file_extension}')
+            for candidate in countries[i:i + BOXART_PROBE_RACE_WIDTH]
+        ]
+        futures = [probe_executor.submit(fetch_boxart_url, boxart_url)
+                   for _, boxart_url in candidates]
+
+        # Wait in priority order so the first valid country wins, not the fastest one
+        for (candidate, boxart_url), future in zip(candidates, futures):
+            if future.result():
+                for other in futures:
+                    other.cancel()
+                return candidate, boxart_url
+
+    return None, None
+
+
+def resolve_boxart_urls(boxart_requests):
+    """Resolve the box art URLs of multiple game IDs concurrently.
+
+    Each request is a `(platform, country, id, region_code)` tuple. Returns a dictionary
+    mapping `(platform, id)` to the box art URL, or `None` when no box art exists.
+    """
+    boxart_urls = {}
+    to_probe = {}
+    for platform, country, id, region_code in boxart_requests:
+        key = (platform, id)
+        if key in boxart_urls or key in to_probe:
+            continue
+
+        boxart_url = get_cached_boxart_url(platform, id)
+        if boxart_url != False:
+            boxart_urls[key] = boxart_url
+            continue
+
+        to_probe[key] = (platform, country, id, region_code)
+
+    if not to_probe:
+        return boxart_urls
+
+    # Every probe of the batch uses the same country order, so the URL found does not depend on
+    # the order probes complete in. Hits found by the batch only apply to the following batches
+    hits_snapshot = get_country_hits_snapshot()
+    batch_hits = []
+
+    _, resolve_executor = get_executors()
+    futures = {resolve_executor.submit(probe_boxart_url, *boxart_request, hits_snapshot): boxart_request
+               for boxart_request in to_probe.values()}
+
+    # Cache and statistics updates stay on this thread
+    for future in as_completed(futures):
+        platform, _, id, region_code = futures[future]
+        country, boxart_url = future.result()
+
+        if boxart_url:
+            batch_hits.append((platform, region_code, country))
+
         cache_boxart_url(platform, id, boxart_url)
-        return boxart_url
+        boxart_urls[(platform, id)] = boxart_url
 
-    # Try with all possible countries
-    for country in GAMETDB_COUNTRIES:
-        boxart_url = f'{GAMETDB_ARTWORK_BASE_URL}/{base_path}/{country}/{id}.{file_extension}'
-        if fetch_boxart_url(boxart_url):
-            cache_boxart_url(platform, id, boxart_url)
-            return boxart_url
+    for platform, region_code, country in batch_hits:
+        record_country_hit(platform, region_code, country)
+    save_boxart_cache()
 
-    cache_boxart_url(platform, id, None)
-    return None
+    return boxart_urls
+
+
+def build_boxart_url(platform, country, id, region_code=''):
+    """Build and validate a boxart URL for a specific platform, country, and game ID."""
+    return resolve_boxart_urls([(platform, country, id, region_code)])[(platform, id)]
 
 
 def find_full_id(id, platform):
     """Retrieve the first game ID that contains a the given ID as a substring"""
     xml_filename = PLATFORM_XML_MAP[platform]
-    for game in tdbs[xml_filename]:
-        if game['id'].startswith(id):
-            return game['id']
-    return None
-
 
-def get_boxart_url_by_id(id, platform):
-    """Retrieve the boxart URL for a game by its ID and platform."""
+    # Range over the IDs starting with the given ID, so the lookup uses the index
+    if not id:
+        rows = reference_db.query(
+            'SELECT id FROM tdb_games WHERE xml = ? ORDER BY position LIMIT 1', (xml_filename,))
+        return rows[0][0] if rows else None
+
+    id_upper_bound = id[:-1] + chr(ord(id[-1]) + 1)
+    rows = reference_db.query('''
+        SELECT id FROM tdb_games
+        WHERE xml = ? AND id >= ? AND id < ?
+        ORDER BY position
+        LIMIT 1
+    ''', (xml_filename, id, id_upper_bound))
+    return rows[0][0] if rows else None
+
+
+def find_name(id, platform):
+    """Retrieve the name of the first game with the given ID."""
+    rows = reference_db.query('''
+        SELECT name FROM tdb_games
+        WHERE xml = ? AND id = ?
+        ORDER BY position
+        LIMIT 1
+    ''', (PLATFORM_XML_MAP[platform], id))
+    return rows[0][0] if rows else None
+
+
+def find_best_match(title, platform, regions):
+    """Find the game whose name best matches a title, as a `(id, name)` tuple.
+
+    The best match is the shortest game name containing the title, among the games
+    of the platform and of any of the given regions.
+    """
+    region_filter = ''
+    if regions:
+        region_filter = f'AND db_region IN ({", ".join("?" * len(regions))})'
+
+    rows = reference_db.query(f'''
+        SELECT id, name, search_key FROM tdb_games
+        WHERE xml = ?
+          AND (platform IS NULL OR platform = ?)
+          {region_filter}
+          AND instr(search_key, ?) > 0
+        ORDER BY position
+    ''', (PLATFORM_XML_MAP[platform], platform, *regions, get_compare_value(title)))
+
+    best_match = None
+    best_match_name = None
+
+    for id, name, name_compare_value in rows:
+        # Update best match
+        if not best_match_name or len(name_compare_value) < len(best_match_name):
+            best_match = (id, name)
+            best_match_name = name
+
+    return best_match
+
+
+def get_boxart_request(id, platform):
+    """Build the box art request for a game by its ID and platform, as expected by `resolve_boxart_urls`."""
     xml_filename = PLATFORM_XML_MAP[platform]
     region_code_pattern = ID_REGION_CODE_PATTERN_MAP[xml_filename]
     valid_id_pattern = SERIAL_GAMETDB_ID_PATTERN_MAP[platform]
@@ -358,82 +604,84 @@ def get_boxart_url_by_id(id, platform):
         return None
     region_code = match.group(1)
 
-    boxart_url = None
     for pattern, country in REGION_CODE_COUNTRY_MAP[xml_filename].items():
         if not re.match(pattern, region_code):
             continue
 
-        boxart_url = build_boxart_url(platform, country, full_valid_id)
-        break
-    return boxart_url
-
-
-def parse(entries, flags):
-    """Parse game entries and enrich them with additional data."""
-    if not tdbs:
-        load_tdbs()
-
-    parse_boxart = flags.get('parse_boxart', True)
-    parse_name = flags.get('parse_name', False)
+        return (platform, country, full_valid_id, region_code)
+    return None
 
-    for entry in entries:
-        xml_filename = PLATFORM_XML_MAP[entry['platform']]
 
-        # If a rom ID is set already, parse the box art URL or name directly
-        if entry.get('rom_id'):
-            if parse_boxart:
-                entry['boxart_url'] = get_boxart_url_by_id(
-                    entry['rom_id'], entry['platform'])
-            if parse_name:
-                for game in tdbs[xml_filename]:
-                    if game['id'] != entry['rom_id']:
-                        continue
+def get_boxart_url_by_id(id, platform):
+    """Retrieve the boxart URL for a game by its ID and platform."""
+    boxart_request = get_boxart_request(id, platform)
+    if not boxart_request:
+        return None
 
-                    entry['title'] = game['name']
-                    break
+    return build_boxart_url(*boxart_request)
 
-            continue
 
-        # We do not have a rom ID, use the logic to find the best matching game in TDB
+def setup(entries, flags):
+    """Start collecting box art requests before parsing entries."""
+    global boxart_requests
+    boxart_requests = []
 
-        # Get a simple to compare value from the entry title
-        title_compare_value = create_search_key(
-            re.sub(r"\(.*", '', entry['title']))
 
-        regions = entry['regions']
-        platform = entry['platform']
+def parse_entry(entry, flags):
+    """Enrich a single entry with additional data, queueing its box art request."""
+    parse_boxart = flags.get('parse_boxart', True)
+    parse_name = flags.get('parse_name', False)
 
-        best_match = None
-        best_match_name = None
+    # If a rom ID is set already, parse the box art URL or name directly
+    if entry.get('rom_id'):
+        if parse_boxart:
+            boxart_requests.append(
+                (entry, get_boxart_request(entry['rom_id'], entry['platform'])))
+        if parse_name:
+            name = find_name(entry['rom_id'], entry['platform'])
+            if name is not None:
+                entry['title'] = name
+
+        return
+
+    # We do not have a rom ID, use the logic to find the best matching game in TDB
+    platform = entry['platform']
+    best_match = find_best_match(entry['title'], platform, entry['regions'])
+
+    if best_match:
+        id, name = best_match
+        if parse_boxart:
+            boxart_requests.append(
+                (entry, get_boxart_request(id, platform)))
+        if parse_name:
+            entry['title'] = name
+
+
+def teardown(entries, flags):
+    """Resolve the queued box art requests concurrently and set the box art URLs."""
+    global boxart_requests
+
+    boxart_urls = resolve_boxart_urls(
+        [boxart_request for _, boxart_request in boxart_requests if boxart_request])
+
+    for entry, boxart_request in boxart_requests:
+        if not boxart_request:
+            entry['boxart_url'] = None
+            continue
 
-        for game in tdbs[xml_filename]:
-            # Skip if platform does not match
-            if platform != TYPE_PLATFORM_MAP[xml_filename].get(game['type'], platform):
-                continue
+        platform, _, id, _ = boxart_request
+        entry['boxart_url'] = boxart_urls[(platform, id)]
 
-            # Skip if game region does not match any of the entry regions
-            game_region = REGION_REGION_MAP.get(game['region'])
-            if regions and game_region not in regions:
-                continue
+    boxart_requests = []
 
-            # Get a simple to compare value from the game name
-            name_compare_value = create_search_key(
-                re.sub(r"\(.*", '', game['name']))
 
-            # Skip if entry title is not a substring of game name
-            if title_compare_value not in name_compare_value:
-                continue
+def parse(entries, flags):
+    """Parse game entries and enrich them with additional data."""
+    setup(entries, flags)
 
-            # Update best match
-            if not best_match_name or len(name_compare_value) < len(best_match_name):
-                best_match = game
-                best_match_name = game['name']
+    for entry in entries:
+        parse_entry(entry, flags)
 
-        if best_match:
-            if parse_boxart:
-                entry['boxart_url'] = get_boxart_url_by_id(
-                    best_match['id'], platform)
-            if parse_name:
-                entry['title'] = best_match['name']
+    teardown(entries, flags)
 
     return entries
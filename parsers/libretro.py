@@ -7,7 +7,8 @@ with ROM IDs and box art URLs.
 import requests
 import re
 from urllib.parse import quote, unquote
-from utils.parse_utils import remove_ext
+from database import reference_db
+from utils.parse_utils import remove_ext, create_search_key, get_files_version
 
 # Platform-specific metadata definitions
 PLATFORMS = {
@@ -312,84 +313,119 @@ PLATFORMS = {
     }
 }
 
-# Global variable to store parsed DATs
-dbs = None
+# Box art index URLs and available box art names for each platform, fetched on first use
+boxart_index_urls = {}
+available_boxarts = {}
 
 
-def load_dbs():
-    """Load and parse the libretro DAT files for each platform."""
-    global dbs
-    dbs = {}
+def iter_dat_games(dat_path):
+    """Iterate over the `(name, serial)` pairs of the games in a DAT file that have both."""
+    # Open and read the .dat file
+    with open(dat_path, encoding='utf-8') as f:
+        lines = f.readlines()
 
-    for platform, data in PLATFORMS.items():
-        dbs[platform] = {}
+    game = None
+    in_rom_section = False
+    for line in lines:
+        line = line.strip()
+        if line.startswith('game ('):
+            # Start of a new game entry
+            game = {}
+            in_rom_section = False
+        elif line.startswith('rom ('):
+            # Start of a ROM section
+            in_rom_section = True
+            if line.endswith(')'):
+                # End of ROM section
+                in_rom_section = False
+        elif line == ')':
+            # End of a game entry
+            if in_rom_section:
+                in_rom_section = False
+            elif game is not None:
+                # Yield game data if both name and serial are present
+                if 'name' in game and 'serial' in game:
+                    yield game['name'], game['serial']
+                game = None
+        elif not in_rom_section:
+            # Parse game name and serial
+            if line.startswith('name') and game is not None:
+                game['name'] = line.split('"', 1)[1].rsplit('"', 1)[0]
+            elif line.startswith('serial') and game is not None:
+                game['serial'] = line.split(
+                    '"', 1)[1].rsplit('"', 1)[0]
+
+
+def get_reference_files():
+    """Retrieve the paths of the DAT files compiled into the reference database."""
+    return [f'data/libretro/{dat_filename}' for data in PLATFORMS.values() for dat_filename in data['dats']]
+
+
+def compile_reference_data(cur):
+    """Insert the games of the DAT files of each platform into the reference database.
 
+    Returns a version hash of the DAT files.
+    """
+    for platform, data in PLATFORMS.items():
         for dat_filename in data['dats']:
-            # Open and read the .dat file
-            with open(f'data/libretro/{dat_filename}', encoding='utf-8') as f:
-                lines = f.readlines()
+            dat_path = f'data/libretro/{dat_filename}'
 
-            game = None
-            in_rom_section = False
-            for line in lines:
-                line = line.strip()
-                if line.startswith('game ('):
-                    # Start of a new game entry
-                    game = {}
-                    in_rom_section = False
-                elif line.startswith('rom ('):
-                    # Start of a ROM section
-                    in_rom_section = True
-                    if line.endswith(')'):
-                        # End of ROM section
-                        in_rom_section = False
-                elif line == ')':
-                    # End of a game entry
-                    if in_rom_section:
-                        in_rom_section = False
-                    elif game is not None:
-                        # Save game data if both name and serial are present
-                        if 'name' in game and 'serial' in game:
-                            # Do not overwrite if present
-                            if not game['name'] in dbs[platform]:
-                                dbs[platform][game['name']] = game['serial']
-                        game = None
-                elif not in_rom_section:
-                    # Parse game name and serial
-                    if line.startswith('name') and game is not None:
-                        game['name'] = line.split('"', 1)[1].rsplit('"', 1)[0]
-                    elif line.startswith('serial') and game is not None:
-                        game['serial'] = line.split(
-                            '"', 1)[1].rsplit('"', 1)[0]
+            # Do not overwrite if present, the first DAT listing a name wins
+            cur.executemany('''
+                INSERT OR IGNORE INTO dat_games (platform, name, serial, search_key)
+                VALUES (?, ?, ?, ?)
+            ''', ((platform, name, serial, create_search_key(name))
+                  for name, serial in iter_dat_games(dat_path)))
 
+    return get_files_version(get_reference_files())
 
-def parse(entries, flags):
-    """Parse a list of entries and enrich them with ROM IDs and box art URLs."""
-    if not dbs:
-        load_dbs()
 
-    for entry in entries:
-        # Retrieve the database for the platform
-        db = dbs.get(entry['platform'])
-        entry['rom_id'] = db.get(entry['title'])
+def get_reference_version():
+    """Retrieve the version hash of the reference data."""
+    return reference_db.get_version()
+
 
-        # Construct the URL for box art thumbnails
-        index_url = f"https://thumbnails.libretro.com/{quote(PLATFORMS[entry['platform']]['system'])}/Named_Boxarts/"
+def get_rom_id(title, platform):
+    """Retrieve the ROM ID of a game listed in the DATs of a platform."""
+    rows = reference_db.query(
+        'SELECT serial FROM dat_games WHERE platform = ? AND name = ?', (platform, title))
+    return rows[0][0] if rows else None
 
-        # If box art list is not cached, fetch it from the server
-        if not 'available_boxarts' in PLATFORMS[entry['platform']]:
-            PLATFORMS[entry['platform']]['available_boxarts'] = []
-            r = requests.get(index_url)
 
-            # Extract box art filenames from the HTML response
-            results = re.findall(
-                r"<tr>.*alt=\"\[IMG\]\".*?href=\"(.*?)\".*?>.*?</tr>", r.text)
-            for result in results:
-                PLATFORMS[entry['platform']]['available_boxarts'].append(
-                    remove_ext(unquote(result)))
+def load_available_boxarts(platform):
+    """Fetch the names of the box arts available for a platform from the libretro thumbnails server."""
+    # Construct the URL for box art thumbnails
+    index_url = f"https://thumbnails.libretro.com/{quote(PLATFORMS[platform]['system'])}/Named_Boxarts/"
+    r = requests.get(index_url)
 
-        # Add box art URL if available
-        if entry['title'] in PLATFORMS[entry['platform']]['available_boxarts']:
-            entry['boxart_url'] = f"{index_url}{quote(entry['title'])}.png"
+    # Extract box art filenames from the HTML response
+    results = re.findall(
+        r"<tr>.*alt=\"\[IMG\]\".*?href=\"(.*?)\".*?>.*?</tr>", r.text)
+
+    boxart_index_urls[platform] = index_url
+    available_boxarts[platform] = {
+        remove_ext(unquote(result)) for result in results}
+
+
+def parse_entry(entry, flags):
+    """Enrich a single entry with its ROM ID and box art URL."""
+    platform = entry['platform']
+
+    # Retrieve the ROM ID from the platform's DATs
+    entry['rom_id'] = get_rom_id(entry['title'], platform)
+
+    # If box art list is not cached, fetch it from the server
+    if platform not in available_boxarts:
+        load_available_boxarts(platform)
+
+    # Add box art URL if available
+    if entry['title'] in available_boxarts[platform]:
+        entry['boxart_url'] = f"{boxart_index_urls[platform]}{quote(entry['title'])}.png"
+
+
+def parse(entries, flags):
+    """Parse a list of entries and enrich them with ROM IDs and box art URLs."""
+    for entry in entries:
+        parse_entry(entry, flags)
 
     return entries
@@ -1,47 +1,95 @@
 """
-This module provides functionality to parse and update entries based on ROM data 
+This module provides functionality to parse and update entries based on ROM data
 extracted from XML files in the MAME software directory.
+
+The XML files are compiled into the reference database once after downloading them,
+so each lookup is a single index seek on the ROM name.
 """
 import os
-import xml.etree.ElementTree as ET
+from database import reference_db
+from utils.parse_utils import iter_xml_elements, get_files_version, create_search_key
 
 # Directory containing XML files with MAME software data
 XMLS_DIR = 'data/mame/hash'
 
-# Global dictionary to store ROMs data
-roms = None
-
 
-def load_roms():
-    """Load ROM data from XML files in the specified directory."""
-    global roms
+def read_software_list(filepath):
+    """Read the ROM names and descriptions of a software list XML file."""
     roms = {}
 
-    for filename in os.listdir(XMLS_DIR):
-        if not filename.endswith('.xml'):
-            continue
+    for software in iter_xml_elements(filepath, 'software'):
+        roms[software.get('name')] = software.findtext('description')
+
+    return roms
+
+
+def get_xml_filenames():
+    """Retrieve the filenames of the XML files in the MAME software directory."""
+    return sorted(filename for filename in os.listdir(XMLS_DIR) if filename.endswith('.xml'))
+
+
+def get_reference_files():
+    """Retrieve the paths of the XML files compiled into the reference database."""
+    return [os.path.join(XMLS_DIR, filename) for filename in get_xml_filenames()]
+
+
+def compile_reference_data(cur):
+    """Insert the software lists of the XML files into the reference database.
+
+    Returns a version hash of the XML files.
+    """
+    xml_filenames = get_xml_filenames()
 
-        filepath = os.path.join(XMLS_DIR, filename)
+    for filename in xml_filenames:
+        list_name = filename[:-len('.xml')]
+        roms = read_software_list(os.path.join(XMLS_DIR, filename))
 
-        tree = ET.parse(filepath)
-        root = tree.getroot()
+        cur.executemany('''
+            INSERT INTO mame_software (list, name, description, search_key)
+            VALUES (?, ?, ?, ?)
+        ''', ((list_name, name, description, create_search_key(description or ''))
+              for name, description in roms.items()))
 
-        for software in root.findall('software'):
-            name = software.get('name')
-            description = software.find('description').text
-            roms[name] = description
+    return get_files_version(get_reference_files())
+
+
+def get_reference_version():
+    """Retrieve the version hash of the reference data."""
+    return reference_db.get_version()
+
+
+def find_description(name, list_names=None):
+    """Find the description of a ROM name in the first software list that contains it.
+
+    Lists are searched in the given order, or in alphabetical order when no lists are given.
+    """
+    rows = reference_db.query(
+        'SELECT list, description FROM mame_software WHERE name = ?', (name,))
+    if not rows:
+        return None
+
+    descriptions = dict(rows)
+    for list_name in list_names or sorted(descriptions):
+        if list_name in descriptions:
+            return descriptions[list_name]
+    return None
+
+
+def parse_entry(entry, flags):
+    """Update the title of a single entry based on ROM data."""
+    list_names = flags.get('software_lists')
+
+    # Check if the entry's title matches a ROM name
+    description = find_description(entry['title'], list_names)
+    if description is not None:
+        entry['rom_id'] = entry['title']
+        # Update the title with the ROM description
+        entry['title'] = description
 
 
 def parse(entries, flags):
     """Parse a list of entries and update their titles based on ROM data."""
-    if not roms:
-        load_roms()
-
     for entry in entries:
-        # Check if the entry's title matches a ROM name
-        if entry['title'] in roms:
-            entry['rom_id'] = entry['title']
-            # Update the title with the ROM description
-            entry['title'] = roms[entry['title']]
+        parse_entry(entry, flags)
 
     return entries
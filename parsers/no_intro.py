@@ -4,7 +4,7 @@ primarily following the No-Intro naming convention. It includes functions
 to extract regions, clean up titles, and normalize their structure.
 """
 import re
-from utils.parse_utils import normalize_repeated_chars
+from functools import lru_cache
 
 # Mapping of regions to their respective database region
 REGIONS_MAP = {
@@ -70,43 +70,68 @@ WORD_ARTICLES = [
     'il', 'i', 'los', 'os'
 ]
 
+# Contents whose parentheses groups are removed from titles. Groups with a '+' in one of their
+# contents have always been kept, as the character was read as a regex quantifier when matching
+# them, and they stay that way so that titles and slugs do not change
+REMOVABLE_CONTENTS = frozenset(
+    content for content in TITLE_REMOVE_LIST if '+' not in content)
+
+# Pattern matching a group of parentheses, capturing its contents
+PARENTHESES_GROUP_PATTERN = re.compile(r"\((.*?)\)")
+
+# Pattern matching a title structure: main name, article, and optional extra info
+ARTICLE_PATTERN = re.compile(r"^(.*?),\s*(\S+)(?:\s+(.*))?$")
+
+# Pattern matching consecutive spaces
+REPEATED_SPACES_PATTERN = re.compile(r" +")
+
+# Maximum number of normalized titles kept in memory
+NORMALIZED_TITLES_CACHE_SIZE = 1 << 16
 
-def parse_regions(title):
-    """Parse the regions from a title."""
-    # Extract all groups of parentheses from the title
-    matches = re.findall(r"\((.*?)\)", title)
 
-    # Split the contents of each parentheses group into subgroups
-    groups = [group.split(',') for group in matches]
+@lru_cache(maxsize=NORMALIZED_TITLES_CACHE_SIZE)
+def normalize_title(title, parse_title_regions=True, clean_title_contents=True, move_title_article=True):
+    """Parse the regions from a title and normalize it in a single pass over its parentheses groups.
 
+    Returns a tuple with the regions and the normalized title. Results are memoized by title and flags.
+    """
     regions = []
-    for group in groups:
-        for content in group:
-            content = content.strip()
-            region = REGIONS_MAP.get(content)
-            if region and region not in regions:
-                regions.append(region)
-        # Stop processing further groups if regions are found
-        if regions:
-            break
+    pieces = []
+    position = 0
 
-    return regions
+    for match in PARENTHESES_GROUP_PATTERN.finditer(title):
+        contents = [content.strip() for content in match.group(1).split(',')]
 
+        # Regions are taken from the first group that has any
+        if parse_title_regions and not regions:
+            for content in contents:
+                region = REGIONS_MAP.get(content)
+                if region and region not in regions:
+                    regions.append(region)
 
-def remove_groups_with_contents(title, contents_to_remove):
-    """Remove parentheses groups containing specific contents."""
+        # Remove the group if all its contents are removable
+        if clean_title_contents and all(content in REMOVABLE_CONTENTS for content in contents):
+            pieces.append(title[position:match.start()])
+            position = match.end()
 
-    # Construct a regex pattern to match parentheses groups containing any of the specified contents
-    contents_pattern = '|'.join(contents_to_remove)
-    pattern = rf"\((?:{contents_pattern})(?:,(?:{contents_pattern}))*\)"
+    if clean_title_contents:
+        pieces.append(title[position:])
+        title = REPEATED_SPACES_PATTERN.sub(' ', ''.join(pieces)).strip()
+
+    if move_title_article:
+        title = move_article(title)
 
-    return re.sub(pattern, '', title)
+    return tuple(regions), title
+
+
+def parse_regions(title):
+    """Parse the regions from a title."""
+    return list(normalize_title(title, True, False, False)[0])
 
 
 def move_article(title):
     """Move the article in a title to the beginning."""
-    # Match the title structure: main name, article, and optional extra info
-    match = re.match(r"^(.*?),\s*(\S+)(?:\s+(.*))?$", title)
+    match = ARTICLE_PATTERN.match(title)
 
     if match:
         name = match.group(1)
@@ -133,55 +158,29 @@ def move_article(title):
 
 def get_clean_title(title):
     """Clean the title by removing unnecessary groups and normalizing it."""
-    clean_title = title
-
-    # Extract all groups of parentheses from the title
-    matches = re.findall(r"\((.*?)\)", title)
-
-    # Split the contents of each parentheses group into subgroups
-    groups = [group.split(',') for group in matches]
-
-    # Remove parentheses groups if they match specific criteria
-    for group in groups:
-        remove_group = True
-        for content in group:
-            content = content.strip()
-            if content not in REGIONS_MAP and content not in LANGUAGES and content not in TITLE_REMOVE_LIST:
-                remove_group = False
-                break
-            if content in REGIONS_MAP and content not in TITLE_REMOVE_LIST:
-                remove_group = False
-                break
-        if remove_group:
-            clean_title = remove_groups_with_contents(clean_title, group)
-
-    # Normalize repeated spaces and move articles
-    clean_title = normalize_repeated_chars(clean_title, ' ')
-
-    return clean_title
+    return normalize_title(title, False, True, False)[1]
 
 
 def process_entry(entry, parse_title_regions, clean_title_contents, move_title_article):
     """Process a single entry by applying various transformations."""
+    parse_title_regions = parse_title_regions and not entry.get('regions')
+
+    regions, entry['title'] = normalize_title(
+        entry['title'], parse_title_regions, clean_title_contents, move_title_article)
+
     if parse_title_regions:
-        if not entry.get('regions'):
-            entry['regions'] = parse_regions(entry['title'])
+        entry['regions'] = list(regions)
 
-    if clean_title_contents:
-        entry['title'] = get_clean_title(entry['title'])
 
-    if move_title_article:
-        entry['title'] = move_article(entry['title'])
+def parse_entry(entry, flags):
+    """Parse a single entry."""
+    process_entry(entry, flags.get('parse_title_regions', True),
+                  flags.get('clean_title_contents', True), flags.get('move_title_article', True))
 
 
 def parse(entries, flags):
     """Parse a list of entries and process each one."""
-    parse_title_regions = flags.get('parse_title_regions', True)
-    clean_title_contents = flags.get('clean_title_contents', True)
-    move_title_article = flags.get('move_title_article', True)
-
     for entry in entries:
-        process_entry(entry, parse_title_regions,
-                      clean_title_contents, move_title_article)
+        parse_entry(entry, flags)
 
     return entries
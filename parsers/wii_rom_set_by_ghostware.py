@@ -29,9 +29,14 @@ def process_entry(entry):
     entry['title'] = get_clean_title(entry['title'])
 
 
+def parse_entry(entry, flags):
+    """Parse a single entry."""
+    process_entry(entry)
+
+
 def parse(entries, flags):
     """Process a list of entries by extracting ROM IDs and cleaning titles."""
     for entry in entries:
-        process_entry(entry)
+        parse_entry(entry, flags)
 
     return entries
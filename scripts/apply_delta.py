@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+This script patches a deployed copy of the ROMs database with a delta created by a build,
+updating its full-text index incrementally instead of replacing the whole database.
+Databases read with `database/query.py` are opened as immutable, so the delta should be applied to
+another copy of the file, which is then linked or moved in place of the one being read.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from database import delta  # noqa: E402
+
+
+def apply_delta(delta_path, db_path):
+    """Apply a delta to a copy of the database."""
+    print(f"Applying delta '{delta_path}' to '{db_path}'...")
+
+    try:
+        changes = delta.apply_delta(delta_path, db_path)
+    except ValueError as e:
+        print(f"Could not apply delta: {e}.")
+        sys.exit(1)
+
+    print(f"Successfully applied {changes} changes to '{db_path}'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('delta_path', help="path of the delta to apply")
+    parser.add_argument('db_path', help="path of the database copy to patch")
+    args = parser.parse_args()
+
+    apply_delta(args.delta_path, args.db_path)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+This script benchmarks the read API of the ROMs database. It runs a suite of typical queries
+(searches of different lengths, searches of full titles, fuzzy searches of misspelled titles,
+filtered searches, deep pages and entry details) and reports the average time of each, without
+and with the results cache.
+
+The queries run on `roms.db` if it exists, or on a database of synthetic entries otherwise.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from database import db_manager, query  # noqa: E402
+from scripts.benchmark_schema import create_entries  # noqa: E402
+
+# Number of times each query is run
+QUERY_RUNS = 200
+
+
+def build_synthetic_database(path):
+    """Build a database of synthetic entries."""
+    db_manager.init_database(path)
+    db_manager.insert_entries(create_entries())
+    db_manager.rebuild_fts()
+    db_manager.build_similarity_index()
+    db_manager.con.commit()
+    db_manager.cur.close()
+    db_manager.con.close()
+
+
+def misspell(rng, title):
+    """Misspell a title by swapping two adjacent letters in each of its longer words."""
+    words = []
+    for word in title.split():
+        if len(word) > 3 and word.isalpha():
+            i = rng.randint(1, len(word) - 3)
+            word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+        words.append(word)
+    return ' '.join(words)
+
+
+def get_suite(slugs, titles, platforms):
+    """Build the suite of queries, as `(name, function)` pairs."""
+    rng = random.Random(0)
+    regions = list(db_manager.REGIONS)
+
+    return [
+        ('search short', lambda: query.search(rng.choice(['ma', 'ze', 'so', 'fi']))),
+        ('search word', lambda: query.search(rng.choice(['mario', 'zelda', 'sonic', 'fantasy']))),
+        ('search phrase', lambda: query.search(rng.choice(['super mario', 'final fantasy', 'metal gear']))),
+        ('search title', lambda: query.search(rng.choice(titles))),
+        ('fuzzy title', lambda: query.fuzzy_search(misspell(rng, rng.choice(titles)))),
+        ('search + platform', lambda: query.search('mario', (rng.choice(platforms),))),
+        ('search + region', lambda: query.search('zelda', (), (rng.choice(regions),))),
+        ('browse platform', lambda: query.search('', (rng.choice(platforms),))),
+        ('deep page', lambda: query.search('', (), (), rng.randint(50, 100))),
+        ('entry', lambda: query.get_entry(rng.choice(slugs)))
+    ]
+
+
+def run_suite(suite, cached):
+    """Run each query of the suite and print its average time in milliseconds."""
+    for name, function in suite:
+        start = time.perf_counter()
+        for _ in range(QUERY_RUNS):
+            if not cached:
+                query.search.cache_clear()
+                query.fuzzy_search.cache_clear()
+                query.get_entry.cache_clear()
+            function()
+        elapsed = (time.perf_counter() - start) * 1000 / QUERY_RUNS
+        print(f"  {name}: {elapsed:.3f}ms")
+
+
+def benchmark_queries(db_path):
+    """Benchmark the read API on a database."""
+    query.open_database(db_path)
+    con = query.get_connection()
+    slugs = [row[0] for row in con.execute('SELECT slug FROM entries ORDER BY random() LIMIT 1000')]
+    titles = [row[0] for row in con.execute('SELECT title FROM entries ORDER BY random() LIMIT 1000')]
+    platforms = [row[0] for row in con.execute('SELECT DISTINCT platform FROM entries')]
+
+    suite = get_suite(slugs, titles, platforms)
+    for cached in (False, True):
+        print("cached:" if cached else "uncached:")
+        run_suite(suite, cached)
+
+    query.close_database()
+
+
+if __name__ == '__main__':
+    # Change the working directory to main db repository location
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    os.chdir('../')
+
+    if os.path.exists(db_manager.DB_NAME):
+        benchmark_queries(db_manager.DB_NAME)
+    else:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, 'roms.db')
+            build_synthetic_database(db_path)
+            benchmark_queries(db_path)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+This script benchmarks the loading of the GameTDB and MAME reference data used by the parsers.
+For each loader it reports the elapsed time and the peak memory allocated while loading, next to
+a baseline that builds the full XML tree of each file before extracting the same fields.
+The compilation of all the reference data into the reference database is measured too.
+"""
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from parsers import gametdb, mame  # noqa: E402
+from database import reference_db  # noqa: E402
+
+
+def load_tdbs_tree():
+    """Load TDB data by parsing the full XML tree of each file."""
+    tdbs = {}
+    for xml_filename in gametdb.XML_FILENAMES:
+        root = ET.parse(f'data/gametdb/{xml_filename}').getroot()
+        tdbs[xml_filename] = [
+            {
+                'name': game.get('name'),
+                'id': game.find('id').text,
+                'type': game.find('type').text,
+                'region': game.find('region').text
+            }
+            for game in root.findall('game')
+        ]
+    return tdbs
+
+
+def load_roms_tree():
+    """Load MAME ROM data by parsing the full XML tree of each file."""
+    roms = {}
+    for filename in os.listdir(mame.XMLS_DIR):
+        if not filename.endswith('.xml'):
+            continue
+
+        root = ET.parse(os.path.join(mame.XMLS_DIR, filename)).getroot()
+        for software in root.findall('software'):
+            roms[software.get('name')] = software.find('description').text
+    return roms
+
+
+def load_roms_stream():
+    """Load MAME ROM data by streaming each XML file."""
+    roms = {}
+    for filename in os.listdir(mame.XMLS_DIR):
+        if filename.endswith('.xml'):
+            roms.update(mame.read_software_list(
+                os.path.join(mame.XMLS_DIR, filename)))
+    return roms
+
+
+def load_tdbs_stream():
+    """Load TDB data by streaming each XML file."""
+    return {xml_filename: list(gametdb.iter_tdb_games(xml_filename))
+            for xml_filename in gametdb.XML_FILENAMES}
+
+
+def measure(function):
+    """Run a function and return its elapsed time in seconds and its peak allocated memory in bytes."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def benchmark_reference_loading():
+    """Benchmark the reference data loaders against the full tree baselines."""
+    benchmarks = [
+        ('gametdb', 'data/gametdb', [
+            ('tree', load_tdbs_tree),
+            ('stream', load_tdbs_stream)
+        ]),
+        ('mame', mame.XMLS_DIR, [
+            ('tree', load_roms_tree),
+            ('stream', load_roms_stream)
+        ]),
+        ('reference', 'data', [
+            ('compile', reference_db.compile_reference_db)
+        ])
+    ]
+
+    for name, data_path, loaders in benchmarks:
+        if not os.path.exists(data_path):
+            print(f"{name}: '{data_path}' not found, skipping.")
+            continue
+
+        for label, function in loaders:
+            elapsed, peak = measure(function)
+            print(
+                f"{name} [{label}]: {elapsed:.2f}s, peak {peak / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == '__main__':
+    # Change the working directory to main db repository location
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    os.chdir('../')
+
+    benchmark_reference_loading()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+This script benchmarks the output database schema against the previous layout, where the
+TEXT slug was the primary key of entries and was repeated in every region and link row, and
+every link row stored the full strings of its attributes.
+Both layouts are filled with the same synthetic entries and given the same secondary indexes,
+without full-text indexes, then their file sizes and the timings of the queries used by the
+site's listing and entry pages are reported.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from database import db_manager  # noqa: E402
+from utils.parse_utils import create_slugs_and_keys  # noqa: E402
+
+# Number of synthetic entries inserted in each layout
+ENTRIES_COUNT = 50000
+
+# Number of times each query is run
+QUERY_RUNS = 200
+
+WORDS = ['super', 'mario', 'legend', 'zelda', 'dragon', 'quest', 'final', 'fantasy', 'sonic',
+         'hedgehog', 'street', 'fighter', 'metal', 'gear', 'solid', 'kart', 'world', 'party']
+
+LEGACY_SCHEMA = [
+    '''
+    CREATE TABLE entries (
+        slug TEXT PRIMARY KEY,
+        rom_id TEXT,
+        search_key TEXT,
+        title TEXT,
+        platform TEXT,
+        boxart_url TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE regions_entries (
+        entry TEXT,
+        region TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE links (
+        entry TEXT,
+        name TEXT,
+        type TEXT,
+        format TEXT,
+        url TEXT,
+        filename TEXT,
+        host TEXT,
+        size INTEGER,
+        size_str TEXT,
+        source_url TEXT
+    )
+    ''',
+    # Same secondary indexes as the current layout, where regions are keyed by entry and region
+    # and links are unique by entry and URL
+    'CREATE INDEX idx_entries_platform ON entries (platform, title);',
+    'CREATE INDEX idx_entries_title ON entries (title);',
+    'CREATE INDEX idx_regions_entries_entry ON regions_entries (entry, region);',
+    'CREATE INDEX idx_regions_entries_region ON regions_entries (region);',
+    'CREATE INDEX idx_links_entry ON links (entry, url);'
+]
+
+LEGACY_QUERIES = {
+    'listing': '''
+        SELECT e.slug, e.title, e.boxart_url, GROUP_CONCAT(r.region)
+        FROM entries e JOIN regions_entries r ON r.entry = e.slug
+        WHERE e.platform = ? AND r.region = ?
+        GROUP BY e.slug
+        ORDER BY e.title
+        LIMIT 100
+    ''',
+    'entry': '''
+        SELECT l.name, l.url, l.size_str
+        FROM entries e JOIN links l ON l.entry = e.slug
+        WHERE e.slug = ?
+    '''
+}
+
+QUERIES = {
+    'listing': '''
+        SELECT e.slug, e.title, e.boxart_url, GROUP_CONCAT(r.region)
+        FROM entries e JOIN regions_entries r ON r.entry = e.id
+        WHERE e.platform = ? AND r.region = ?
+        GROUP BY e.id
+        ORDER BY e.title
+        LIMIT 100
+    ''',
+    'entry': '''
+        SELECT l.name, l.url, l.size_str
+        FROM entries e JOIN links l ON l.entry = e.id
+        WHERE e.slug = ?
+    '''
+}
+
+
+def create_entries():
+    """Create a deterministic list of synthetic entries."""
+    rng = random.Random(0)
+    platforms = list(db_manager.PLATFORMS)
+    regions = list(db_manager.REGIONS)
+    entries = []
+
+    for i in range(ENTRIES_COUNT):
+        title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+        platform = rng.choice(platforms)
+        entries.append({
+            'title': f'{title} {i}',
+            'platform': platform,
+            'regions': rng.sample(regions, rng.randint(1, 2)),
+            'rom_id': None,
+            'boxart_url': None,
+            'links': [
+                {
+                    'name': f'{title} {i} ({j})',
+                    'type': 'Game',
+                    'format': 'zip',
+                    'url': f'https://myrient.erista.me/files/{platform}/{title} {i} ({j}).zip',
+                    'filename': f'{title} {i} ({j}).zip',
+                    'host': 'Myrient',
+                    'size': 1024 * rng.randint(1, 1 << 20),
+                    'size_str': '1.0 MB',
+                    'source_url': f'https://myrient.erista.me/files/{platform}/'
+                }
+                for j in range(rng.randint(1, 3))
+            ]
+        })
+
+    return entries
+
+
+def build_legacy(path, entries):
+    """Fill a database with the previous layout."""
+    con = sqlite3.connect(path)
+    for statement in LEGACY_SCHEMA:
+        con.execute(statement)
+
+    for entry in entries:
+        con.execute('INSERT INTO entries (slug, rom_id, search_key, title, platform, boxart_url) VALUES (?, ?, ?, ?, ?, ?)',
+                    (entry['slug'], entry['rom_id'], entry['search_key'], entry['title'], entry['platform'], entry['boxart_url']))
+        con.executemany('INSERT INTO regions_entries (entry, region) VALUES (?, ?)',
+                        [(entry['slug'], region) for region in entry['regions']])
+        con.executemany('INSERT INTO links (entry, name, type, format, url, filename, host, size, size_str, source_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        [(entry['slug'], link['name'], link['type'], link['format'], link['url'], link['filename'],
+                          link['host'], link['size'], link['size_str'], link['source_url']) for link in entry['links']])
+
+    con.commit()
+    con.execute('VACUUM;')
+    con.close()
+
+
+def build_current(path, entries):
+    """Fill a database with the current layout, leaving its full-text and similarity indexes empty like the previous layout."""
+    db_manager.init_database(path)
+    db_manager.insert_entries([dict(entry) for entry in entries])
+    db_manager.con.commit()
+    db_manager.con.execute('VACUUM;')
+    db_manager.cur.close()
+    db_manager.con.close()
+
+
+def time_queries(path, queries, entries):
+    """Run each query on a database and return the average time of each in milliseconds."""
+    rng = random.Random(1)
+    con = sqlite3.connect(path)
+    timings = {}
+
+    for name, sql in queries.items():
+        start = time.perf_counter()
+        for _ in range(QUERY_RUNS):
+            entry = rng.choice(entries)
+            params = (entry['platform'], entry['regions'][0]) if name == 'listing' else (entry['slug'],)
+            con.execute(sql, params).fetchall()
+        timings[name] = (time.perf_counter() - start) * 1000 / QUERY_RUNS
+
+    con.close()
+    return timings
+
+
+def benchmark_schema():
+    """Benchmark the current output schema against the previous layout."""
+    entries = create_entries()
+    for entry, (slug, search_key) in zip(entries, create_slugs_and_keys(entries)):
+        entry['slug'] = slug
+        entry['search_key'] = search_key
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        layouts = [
+            ('legacy', build_legacy, LEGACY_QUERIES),
+            ('current', build_current, QUERIES)
+        ]
+
+        for label, build, queries in layouts:
+            path = os.path.join(temp_dir, f'{label}.db')
+            build(path, entries)
+
+            size = os.path.getsize(path)
+            timings = time_queries(path, queries, entries)
+            print(f"{label}: {size / 1024 / 1024:.1f} MiB, " +
+                  ', '.join(f"{name} {elapsed:.2f}ms" for name, elapsed in timings.items()))
+
+
+if __name__ == '__main__':
+    benchmark_schema()
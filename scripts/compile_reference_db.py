@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""
+This script compiles the downloaded libretro DAT files, GameTDB XML files and MAME
+hash files into the indexed reference database, so the parsers can query it instead
+of parsing every file on each run.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from database import reference_db  # noqa: E402
+
+
+def compile_reference_db():
+    """Compile the reference database from the downloaded data files."""
+    print("Compiling reference database...")
+
+    reference_db.compile_reference_db()
+
+    print(f"Successfully compiled reference database in {reference_db.REFERENCE_DB_NAME}")
+
+
+if __name__ == '__main__':
+    # Change the working directory to main db repository location
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    os.chdir('../')
+
+    compile_reference_db()
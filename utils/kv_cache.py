@@ -0,0 +1,164 @@
+"""
+This module provides a persistent key-value cache backed by a SQLite database.
+Writes are buffered in memory and flushed in batches inside a single transaction,
+so an interrupted run never leaves a partially written cache behind. Stored values
+can expire after a given time to live, with a separate one for `None` values, and
+the cache can be bounded to a maximum number of entries, evicting the first written
+ones. Reading a value does not refresh it, so eviction is first in, first out rather
+than least recently used, and values still expire after their time to live.
+"""
+import json
+import os
+import sqlite3
+import time
+
+# Maximum number of keys looked up in a single query
+MAX_KEYS_PER_QUERY = 500
+
+
+class KeyValueCache:
+    """A SQLite-backed key-value cache with batched writes and expiring entries."""
+
+    def __init__(self, path, ttl=None, none_ttl=None, flush_every=100, max_entries=None):
+        """Open (or create) the cache database at the given path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.none_ttl = none_ttl
+        self.flush_every = flush_every
+        self.max_entries = max_entries
+        self.pending = {}
+
+        self.con = sqlite3.connect(path, timeout=60)
+        self.con.execute('PRAGMA journal_mode = WAL;')
+        self.con.execute('PRAGMA synchronous = NORMAL;')
+        self.con.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at REAL
+            )
+        ''')
+        self.con.execute(
+            'CREATE INDEX IF NOT EXISTS idx_cache_updated_at ON cache (updated_at);')
+        self.con.commit()
+
+    def is_expired(self, value, updated_at):
+        """Check whether a stored value is older than its time to live."""
+        ttl = self.none_ttl if value is None else self.ttl
+        return ttl is not None and time.time() - updated_at > ttl
+
+    def get(self, key, default=None):
+        """Retrieve the value stored for a key, or the default if missing or expired."""
+        if key in self.pending:
+            return self.pending[key][0]
+
+        row = self.con.execute(
+            'SELECT value, updated_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return default
+
+        value = json.loads(row[0])
+        if self.is_expired(value, row[1]):
+            return default
+        return value
+
+    def get_many(self, keys):
+        """Retrieve the values stored for multiple keys, as a dictionary of the keys found."""
+        values = {}
+        remaining = []
+        for key in keys:
+            if key in self.pending:
+                values[key] = self.pending[key][0]
+            else:
+                remaining.append(key)
+
+        for i in range(0, len(remaining), MAX_KEYS_PER_QUERY):
+            chunk = remaining[i:i + MAX_KEYS_PER_QUERY]
+            rows = self.con.execute(
+                f'SELECT key, value, updated_at FROM cache WHERE key IN ({", ".join("?" * len(chunk))})', chunk)
+
+            for key, value, updated_at in rows:
+                value = json.loads(value)
+                if not self.is_expired(value, updated_at):
+                    values[key] = value
+
+        return values
+
+    def set(self, key, value):
+        """Store a value for a key, flushing pending writes once the batch is full."""
+        self.pending[key] = (value, time.time())
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def update(self, items):
+        """Store multiple key-value pairs."""
+        for key, value in items.items():
+            self.set(key, value)
+
+    def modify(self, key, function, default=None):
+        """Replace the value stored for a key with the result of a function of it, atomically.
+
+        The value is read and written in a single write transaction, so concurrent processes
+        modifying the same key never lose each other's changes.
+        """
+        self.flush()
+        self.pending.pop(key, None)
+
+        with self.con:
+            self.con.execute('BEGIN IMMEDIATE')
+            row = self.con.execute(
+                'SELECT value, updated_at FROM cache WHERE key = ?', (key,)).fetchone()
+
+            value = default
+            if row and not self.is_expired(json.loads(row[0]), row[1]):
+                value = json.loads(row[0])
+
+            value = function(value)
+            self.con.execute(
+                'INSERT OR REPLACE INTO cache (key, value, updated_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time()))
+        return value
+
+    def is_empty(self):
+        """Check whether the cache holds no entries at all."""
+        if self.pending:
+            return False
+        return self.con.execute('SELECT 1 FROM cache LIMIT 1').fetchone() is None
+
+    def flush(self):
+        """Write all pending values to the database in a single transaction."""
+        if not self.pending:
+            return
+
+        with self.con:
+            self.con.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, updated_at) VALUES (?, ?, ?)',
+                [(key, json.dumps(value), updated_at)
+                 for key, (value, updated_at) in self.pending.items()]
+            )
+        self.pending = {}
+
+    def evict(self):
+        """Delete the first written entries exceeding the maximum number of entries, regardless of when they were last read."""
+        if self.max_entries is None:
+            return
+
+        self.flush()
+        with self.con:
+            count = self.con.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            if count > self.max_entries:
+                self.con.execute('''
+                    DELETE FROM cache WHERE key IN (
+                        SELECT key FROM cache ORDER BY updated_at LIMIT ?
+                    )
+                ''', (count - self.max_entries,))
+
+    def close(self):
+        """Flush pending values, evict the first written entries if needed and close the database connection."""
+        self.evict()
+        self.flush()
+        self.con.close()
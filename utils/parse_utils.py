@@ -1,25 +1,40 @@
 """
 This module provides utility functions for parsing, normalizing, and manipulating strings, filenames, 
-URLs, and file sizes. These functions are designed to handle common tasks such as sanitizing input, 
+URLs, file sizes, and XML files. These functions are designed to handle common tasks such as sanitizing input, 
 creating slugs, and converting between human-readable and byte-based file sizes.
 """
 import os
 import re
+import hashlib
 import urllib
+import xml.etree.ElementTree as ET
+from functools import lru_cache
 from unidecode import unidecode
 
-
-def replace_invalid_chars(title):
-    """Replace invalid characters in a string with valid substitutes."""
-    for value1, value2 in {
+# Translation table replacing invalid characters with valid substitutes
+INVALID_CHARS_TABLE = str.maketrans({
+    value1: f' {value2} ' for value1, value2 in {
         '+': 'plus',
         '&': 'and',
         '™': '',
         '©': '',
         '®': ''
-    }.items():
-        title = title.replace(value1, f' {value2} ')
-    return title
+    }.items()
+})
+
+# Pattern matching runs of characters that are not allowed in slugs
+SLUG_INVALID_CHARS_PATTERN = re.compile(r"[^a-zA-Z0-9]+")
+
+# Pattern matching characters that are not allowed in search keys
+SEARCH_KEY_INVALID_CHARS_PATTERN = re.compile(r"[^a-z0-9]+")
+
+# Maximum number of normalized titles kept in memory
+NORMALIZED_TITLES_CACHE_SIZE = 1 << 17
+
+
+def replace_invalid_chars(title):
+    """Replace invalid characters in a string with valid substitutes."""
+    return title.translate(INVALID_CHARS_TABLE)
 
 
 def remove_ext(filename):
@@ -33,37 +48,64 @@ def remove_ext(filename):
     return name
 
 
+def get_files_version(paths):
+    """Compute a version hash of a list of files from their paths, sizes and modification times."""
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()
+
+
 def normalize_repeated_chars(text, char):
     """Replace consecutive occurrences of a character with a single instance."""
     escaped_char = re.escape(char)  # Escape special characters for regex
     return re.sub(f'{escaped_char}+', char, text).strip()
 
 
-def create_slug(entry):
-    """Create a URL-friendly slug from an entry dictionary."""
-    title = entry['title']
-
+@lru_cache(maxsize=NORMALIZED_TITLES_CACHE_SIZE)
+def normalize_title(title):
+    """Normalize a title to ASCII, returning it along with its search key. Results are memoized."""
     title = replace_invalid_chars(title)
-    title = unidecode(title)
-    platform = entry['platform']
-    regions = '-'.join(entry['regions'])
-    slug = f"{title}-{platform}-{regions}"
-    
-    slug = re.sub(r"[^a-zA-Z0-9-]", '-', slug).lower()
-    slug = normalize_repeated_chars(slug, '-').strip('-')
 
-    return slug
+    # Transliteration is only needed for non-ASCII titles
+    if not title.isascii():
+        title = unidecode(title)
+
+    search_key = SEARCH_KEY_INVALID_CHARS_PATTERN.sub('', title.lower())
+
+    return title, search_key
+
+
+def build_slug(ascii_title, platform, regions):
+    """Build a slug from an already normalized title, a platform and a list of regions."""
+    slug = f"{ascii_title}-{platform}-{'-'.join(regions)}"
+    return SLUG_INVALID_CHARS_PATTERN.sub('-', slug).lower().strip('-')
+
+
+def create_slug(entry):
+    """Create a URL-friendly slug from an entry dictionary."""
+    ascii_title, _ = normalize_title(entry['title'])
+    return build_slug(ascii_title, entry['platform'], entry['regions'])
 
 
 def create_search_key(title):
     """Generate a search-friendly key from the given title by normalizing and sanitizing it."""
-    title = replace_invalid_chars(title)
-    title = unidecode(title)
-    title = title.lower()
-    title = re.sub(r"[^a-z0-9]", '', title)
-    title = title.strip()
+    return normalize_title(title)[1]
+
+
+def create_slugs_and_keys(entries):
+    """Create the slugs and search keys of multiple entries, normalizing each title only once.
+
+    Returns a list of `(slug, search_key)` tuples in the same order as the entries.
+    """
+    slugs_and_keys = []
+    for entry in entries:
+        ascii_title, search_key = normalize_title(entry['title'])
+        slugs_and_keys.append(
+            (build_slug(ascii_title, entry['platform'], entry['regions']), search_key))
 
-    return title
+    return slugs_and_keys
 
 
 def size_bytes_to_str(size):
@@ -108,3 +150,30 @@ def join_urls(url, *links):
         # Ensure proper joining of URLs by stripping and appending slashes
         url = urllib.parse.urljoin(url.rstrip('/') + '/', link.lstrip('/'))
     return url
+
+
+def iter_xml_elements(filepath, tag):
+    """Stream the direct children of an XML file's root element with the given tag.
+
+    Each element is complete when yielded and is discarded as soon as the iteration moves on,
+    so the whole document is never held in memory.
+    """
+    root = None
+    depth = 0
+
+    for event, elem in ET.iterparse(filepath, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
+
+        if elem.tag == tag:
+            yield elem
+
+        # Drop every processed child of the root element
+        root.clear()
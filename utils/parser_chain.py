@@ -0,0 +1,181 @@
+"""
+This module provides a chain executor for running several parsers over the same entries.
+The parsers of a source are compiled into a single per-entry pipeline, so each entry is
+fully processed by all of them in one pass instead of one pass per parser.
+
+A parser takes part in a chain by exposing `parse_entry(entry, flags)`, and optionally
+`setup(entries, flags)` and `teardown(entries, flags)` for work done once per batch of
+entries, before and after the per-entry pass, and `get_reference_version()` returning a
+version hash of the reference data it reads.
+
+Results of a chain can be memoized on disk across runs. The memo is keyed by the names,
+flags and versions of the chain's parsers and by the input fields of each entry, so an
+entry only goes through the parsers again when one of them changes. The version of a parser
+covers its code, the code of the repository modules it imports, directly or through other
+ones, and its reference data.
+"""
+import hashlib
+import json
+import sys
+import types
+from utils.kv_cache import KeyValueCache
+
+PARSER_MEMO_PATH = 'cache/parser_memo.db'
+
+# Time after which a memoized result is computed again (in seconds), to pick up changes in
+# remote data the parsers read, like available box arts
+PARSER_MEMO_TTL = 7 * 24 * 60 * 60
+
+# Maximum number of memoized results kept on disk
+PARSER_MEMO_MAX_ENTRIES = 2000000
+
+# Packages of the repository whose modules the output of the parsers may depend on
+HELPER_PACKAGES = ('parsers', 'utils', 'database')
+
+# Entry fields the parsers never read or write, left out of the memo
+UNPARSED_FIELDS = ('links',)
+
+# Memo of parser chain results, opened on first use
+memo = None
+
+# Version hashes of the parsers, computed on first use
+parser_versions = {}
+
+
+def load_memo():
+    """Open the parser memo."""
+    global memo
+    if memo is None:
+        memo = KeyValueCache(PARSER_MEMO_PATH, ttl=PARSER_MEMO_TTL,
+                             flush_every=10000, max_entries=PARSER_MEMO_MAX_ENTRIES)
+    return memo
+
+
+def close_memo():
+    """Close the parser memo, evicting the first written results if it is over its size."""
+    global memo
+    if memo is not None:
+        memo.close()
+        memo = None
+
+
+def get_helper_modules(module):
+    """Retrieve the repository modules a module imports, directly or through other ones, sorted by name."""
+    helpers = {}
+    pending = [module]
+    while pending:
+        current = pending.pop()
+        for value in vars(current).values():
+            # Functions and classes imported from a module are traced back to it
+            if isinstance(value, types.ModuleType):
+                name = value.__name__
+            else:
+                name = getattr(value, '__module__', None)
+
+            if not isinstance(name, str) or name.split('.')[0] not in HELPER_PACKAGES or \
+                    name == module.__name__ or name in helpers:
+                continue
+
+            helper = sys.modules.get(name)
+            if helper is not None and getattr(helper, '__file__', None):
+                helpers[name] = helper
+                pending.append(helper)
+
+    return [helpers[name] for name in sorted(helpers)]
+
+
+def get_parser_version(parser):
+    """Compute a version hash of a parser from its code, the code of the modules it imports and its reference data."""
+    if parser.__name__ not in parser_versions:
+        with open(parser.__file__, 'rb') as f:
+            digest = hashlib.sha1(f.read())
+
+        for helper in get_helper_modules(parser):
+            with open(helper.__file__, 'rb') as f:
+                digest.update(f'{helper.__name__}:'.encode())
+                digest.update(f.read())
+
+        if hasattr(parser, 'get_reference_version'):
+            digest.update(parser.get_reference_version().encode())
+
+        parser_versions[parser.__name__] = digest.hexdigest()
+
+    return parser_versions[parser.__name__]
+
+
+def get_parsed_fields(entry):
+    """Get the fields of an entry that are read or written by the parsers."""
+    return {key: value for key, value in entry.items() if key not in UNPARSED_FIELDS}
+
+
+def get_memo_keys(parsers, entries):
+    """Compute the memo keys of entries going through a chain of parsers."""
+    chain_digest = hashlib.sha1(json.dumps(
+        [[parser.__name__, flags, get_parser_version(parser)]
+         for parser, flags in parsers], sort_keys=True).encode())
+
+    keys = []
+    for entry in entries:
+        digest = chain_digest.copy()
+        digest.update(json.dumps(get_parsed_fields(
+            entry), sort_keys=True).encode())
+        keys.append(digest.hexdigest())
+
+    return keys
+
+
+def compile_chain(parsers):
+    """Compile a list of `(parser, flags)` pairs into a single function processing one entry."""
+    steps = [(parser.parse_entry, flags) for parser, flags in parsers]
+
+    def process_entry(entry):
+        for parse_entry, flags in steps:
+            parse_entry(entry, flags)
+
+    return process_entry
+
+
+def execute_chain(parsers, entries):
+    """Run a list of `(parser, flags)` pairs over a batch of entries in a single pass."""
+    if not entries:
+        return entries
+
+    for parser, flags in parsers:
+        if hasattr(parser, 'setup'):
+            parser.setup(entries, flags)
+
+    process_entry = compile_chain(parsers)
+    for entry in entries:
+        process_entry(entry)
+
+    for parser, flags in parsers:
+        if hasattr(parser, 'teardown'):
+            parser.teardown(entries, flags)
+
+    return entries
+
+
+def run_chain(parsers, entries, use_memo=False):
+    """Run a list of `(parser, flags)` pairs over a batch of entries, reusing memoized results if enabled."""
+    if not use_memo:
+        return execute_chain(parsers, entries)
+
+    load_memo()
+
+    keys = get_memo_keys(parsers, entries)
+    results = memo.get_many(keys)
+
+    pending = []
+    for entry, key in zip(entries, keys):
+        if key in results:
+            entry.update(results[key])
+        else:
+            pending.append((entry, key))
+
+    execute_chain(parsers, [entry for entry, _ in pending])
+
+    for entry, key in pending:
+        memo.set(key, get_parsed_fields(entry))
+    memo.flush()
+
+    return entries
@@ -7,6 +7,7 @@ from make import make
 from scripts.download_gametdb_xmls import download_gametdb_xmls
 from scripts.download_libretro_dats import download_libretro_dats
 from scripts.download_mame_hashes import download_mame_hashes
+from scripts.compile_reference_db import compile_reference_db
 
 if __name__ == '__main__':
     # Change directory to script location
@@ -15,4 +16,5 @@ if __name__ == '__main__':
     download_gametdb_xmls()
     download_libretro_dats()
     download_mame_hashes()
+    compile_reference_db()
     make()